@@ -0,0 +1,155 @@
+import contextlib
+import copy
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+
+class LLMOverloaded(Exception):
+    # raised instead of queueing a model call when the server is already at capacity.
+    # retry_after is a whole number of seconds, suitable for a Retry-After header
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many model calls in progress, retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    # caps how many model calls run at once across the whole process. callers beyond the cap wait in a bounded
+    # queue; when the queue is full (or a caller has waited wait_timeout seconds) LLMOverloaded is raised right
+    # away, so request threads fail fast instead of piling up behind the provider
+
+    def __init__(self, max_concurrent=8, max_waiting=32, wait_timeout=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+
+        self._active = 0
+        self._waiting = 0
+        # calls handed to a thread pool that haven't finished yet (see reserve)
+        self._reserved = 0
+        # moving average of how long a call holds its slot, used to estimate retry-after
+        self._average_seconds = 5.0
+        self._condition = threading.Condition()
+
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    @contextlib.contextmanager
+    def slot(self):
+        self._acquire()
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started_at
+            with self._condition:
+                self._active -= 1
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * elapsed
+                self._condition.notify()
+
+    def reserve(self, count=1):
+        # admission for model calls handed to a thread pool. a pool's own queue is unbounded and has no timeout,
+        # so without this requests would wait there (and fail at their deadline) instead of ever reaching the
+        # queue above. raises LLMOverloaded on the calling thread, before anything is submitted, when count more
+        # calls wouldn't fit in the running slots plus the queue. call release() once per call when it finishes
+        with self._condition:
+            if self._reserved + count > self.max_concurrent + self.max_waiting:
+                self.stats["rejected"] += 1
+                raise LLMOverloaded(self._retry_after())
+            self._reserved += count
+
+    def release(self, count=1):
+        with self._condition:
+            self._reserved -= count
+
+    def reject_early(self):
+        # lets routes refuse before doing any work: returns the retry-after in seconds when a new call would be
+        # rejected right now, otherwise None
+        with self._condition:
+            if self._waiting < self.max_waiting and self._reserved < self.max_concurrent + self.max_waiting:
+                return None
+            self.stats["rejected"] += 1
+            return self._retry_after()
+
+    def busy(self):
+        # true when a new call would have to wait, used to skip optional work such as prefetching
+        with self._condition:
+            return self._active >= self.max_concurrent or self._waiting > 0 or self._reserved >= self.max_concurrent
+
+    def snapshot(self):
+        with self._condition:
+            return dict(self.stats, active=self._active, waiting=self._waiting, reserved=self._reserved)
+
+    def _retry_after(self):
+        # caller holds the lock. roughly how long until everyone already waiting (or reserved but not yet
+        # started) has had a turn
+        ahead = max(self._waiting, self._reserved - self.max_concurrent)
+        return max(1, math.ceil(self._average_seconds * (ahead + 1) / self.max_concurrent))
+
+    def _acquire(self):
+        with self._condition:
+            if self._active < self.max_concurrent:
+                self._active += 1
+                self.stats["admitted"] += 1
+                return
+            if self._waiting >= self.max_waiting:
+                self.stats["rejected"] += 1
+                raise LLMOverloaded(self._retry_after())
+
+            self.stats["queued"] += 1
+            self._waiting += 1
+            deadline = time.monotonic() + self.wait_timeout
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timed_out"] += 1
+                        raise LLMOverloaded(self._retry_after())
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            self.stats["admitted"] += 1
+
+
+class SingleFlight:
+    # coalesces concurrent calls that share a key: the first caller runs fn, and everyone who asks for the same key
+    # while it's running waits for that result (or exception) instead of making an identical model call.
+    # followers get a deep copy, so no two requests mutate the same graph
+
+    def __init__(self):
+        self._calls = {}  # key -> Future of the running call
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            # followers copy from a snapshot, since the leader's caller is free to mutate its own result
+            future.set_result(copy.deepcopy(result))
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._calls))
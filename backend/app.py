@@ -1,11 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import json
 import ast
-import re
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from response_cache import ResponseCache, fingerprint_code, make_cache_key, statement_lines
+from json_stream import JsonArrayItemStream, JsonStringFieldStream
+from json_recovery import recover_json
+from ast_summary import summarize_code_tree
+from batch import read_jsonl, run_batch
+from incremental import diff_units, find_call_sites, merge_units, namespace_unit_graph, split_units
+from graph_layout import graph_shape, layout_shape, shape_key
+from admission import ConcurrencyLimiter, LLMOverloaded, SingleFlight
+from metrics import (
+    HTTP_REQUEST_SECONDS, HTTP_REQUESTS, JSON_PARSE_PHASES, MODEL_QUEUE_SECONDS, PROMPT_CHARS, REGISTRY, TraceLog,
+    record_model_call, stage, submit_traced, trace_event,
+)
 
 # loading environment variables (similar approach found here: https://stackoverflow.com/questions/4906977)
 load_dotenv(r"C:\Users\nchai\OneDrive\Desktop\key.env")
@@ -14,8 +30,121 @@ app = Flask(__name__)
 # enabling cors for frontend-backend communication (ref: https://flask-cors.readthedocs.io/en/latest/)
 CORS(app)
 
-# creating openai client (ref: https://platform.openai.com/docs/api-reference)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# creating openai client (ref: https://platform.openai.com/docs/api-reference).
+# OPENAI_BASE_URL points it at any compatible server instead, e.g. benchmarks/mock_openai.py for load tests
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+
+# admission control for every model call in the process (see create_chat_completion): at most
+# FLEX_MAX_CONCURRENT_LLM_CALLS run at once, up to FLEX_MAX_QUEUED_LLM_CALLS wait for a slot, and anything beyond
+# that is answered with a 429 and a Retry-After instead of tying up a request thread
+llm_limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.getenv("FLEX_MAX_CONCURRENT_LLM_CALLS", "8")),
+    max_waiting=int(os.getenv("FLEX_MAX_QUEUED_LLM_CALLS", "32")),
+    wait_timeout=float(os.getenv("FLEX_LLM_QUEUE_TIMEOUT", "10")),
+)
+
+# the graph and explanation calls don't depend on each other, so they share a thread pool
+# and run side by side (ref: https://docs.python.org/3/library/concurrent.futures.html).
+# work only reaches it through submit_admitted, and by default there's a thread for every call the limiter
+# admits, so calls wait in the limiter's queue (with its timeout) rather than in the pool's
+llm_executor = ThreadPoolExecutor(max_workers=int(
+    os.getenv("FLEX_LLM_WORKERS", str(llm_limiter.max_concurrent + llm_limiter.max_waiting))
+))
+
+# identical calls already in flight (same cache key) are joined instead of repeated, e.g. a whole class
+# submitting the starter code the moment an assignment opens
+model_calls = SingleFlight()
+
+# per-stage timings and token counts are always collected for /metrics. FLEX_TRACE_SAMPLE_RATE (0-1) additionally
+# writes a json trace of that fraction of requests, raw model responses included, to FLEX_TRACE_LOG (or stdout)
+trace_log = TraceLog(sample_rate=float(os.getenv("FLEX_TRACE_SAMPLE_RATE", "0")), path=os.getenv("FLEX_TRACE_LOG"))
+
+# counters kept by the caches and the admission layer, copied into gauges whenever /metrics is scraped
+COMPONENT_STATS = REGISTRY.gauge(
+    "flex_component_stat", "Counters and sizes reported by the caches and the admission layer.", ["component", "stat"]
+)
+
+# per-call deadlines in seconds, measured from when both calls are started
+GRAPH_DEADLINE_SECONDS = float(os.getenv("FLEX_GRAPH_DEADLINE", "60"))
+EXPLANATION_DEADLINE_SECONDS = float(os.getenv("FLEX_EXPLANATION_DEADLINE", "30"))
+
+# when on, /api/analyze_code returns only the graph skeleton (labels, line spans, error flags) and the
+# explanations are generated on demand through /api/get_explanation
+LAZY_EXPLANATIONS = os.getenv("FLEX_LAZY_EXPLANATIONS", "1") == "1"
+# how many flagged nodes get their explanation generated ahead of the click
+PREFETCH_ERROR_EXPLANATIONS = int(os.getenv("FLEX_PREFETCH_ERROR_EXPLANATIONS", "3"))
+
+# concurrent model calls per batch run (/api/analyze_batch and batch.py)
+BATCH_WORKERS = int(os.getenv("FLEX_BATCH_WORKERS", "4"))
+
+MODEL_NAME = "gpt-4o-2024-11-20"
+
+# how the ast is described in the graph prompt: "outline" is a compact, token-budgeted statement outline
+# (see ast_summary.py), "full" is every ast node and edge from analyze_code_tree
+AST_CONTEXT_MODE = os.getenv("FLEX_AST_CONTEXT", "outline")
+AST_TOKEN_BUDGET = int(os.getenv("FLEX_AST_TOKEN_BUDGET", "1500"))
+
+# bump this whenever either prompt changes, so old cached responses stop matching
+PROMPT_VERSION = f"5-{AST_CONTEXT_MODE}"
+
+# both prompts run at temperature=0, so identical (normalized) submissions can share one response.
+# setting FLEX_CACHE_DB adds an sqlite tier that survives restarts and is shared across workers
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("FLEX_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("FLEX_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("FLEX_CACHE_TTL", str(24 * 60 * 60))),
+    db_path=os.getenv("FLEX_CACHE_DB"),
+)
+
+# last analyzed state of each incremental session (see analyze_code_incremental), sharing the sqlite file if set
+session_store = ResponseCache(
+    max_entries=int(os.getenv("FLEX_SESSION_MAX_ENTRIES", "2048")),
+    ttl_seconds=float(os.getenv("FLEX_SESSION_TTL", str(4 * 60 * 60))),
+    db_path=os.getenv("FLEX_CACHE_DB"),
+    table="sessions",
+)
+
+# node positions by graph shape (see graph_layout.graph_shape); a layout is small and never goes stale
+layout_cache = ResponseCache(max_entries=int(os.getenv("FLEX_LAYOUT_CACHE_ENTRIES", "4096")), ttl_seconds=None)
+
+def request_route():
+    # the matched url rule rather than the raw path, so unknown urls can't blow up label cardinality
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    g.request_started_at = time.monotonic()
+    g.trace = trace_log.start(request_route()) if request_route() != "/metrics" else None
+
+@app.after_request
+def finish_request_metrics(response):
+    route = request_route()
+    started_at = g.request_started_at
+    trace = g.trace
+    status = response.status_code
+
+    def record():
+        HTTP_REQUESTS.inc(route=route, status=str(status))
+        HTTP_REQUEST_SECONDS.observe(time.monotonic() - started_at, route=route)
+        trace_log.finish(trace, status)
+
+    # on close rather than now, so streamed responses are timed until their last event
+    response.call_on_close(record)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # prometheus scrape endpoint (ref: https://prometheus.io/docs/instrumenting/exposition_formats/)
+    components = {
+        "response_cache": response_cache.snapshot(),
+        "layout_cache": layout_cache.snapshot(),
+        "admission": llm_limiter.snapshot(),
+        "single_flight": model_calls.snapshot(),
+    }
+    for component, stats in components.items():
+        for stat, value in stats.items():
+            COMPONENT_STATS.set(value, component=component, stat=stat)
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/api/analyze_code", methods=["POST"])
 def analyze_code():
@@ -27,23 +156,61 @@ def analyze_code():
 
     code = data["code"]
     intent = data["intent"]
+    session_id = data.get("session_id")
+
+    retry_after = llm_limiter.reject_early()
+    if retry_after:
+        return overloaded_response(retry_after)
 
     try:
-        # parsing user code with ast for more context (concept borrowed from https://docs.python.org/3/library/ast.html)
-        tree = ast.parse(code)
-        python_ast_context = analyze_code_tree(tree)
+        if session_id:
+            # resubmission within an editing session: only functions that changed get sent to the model
+            return jsonify(analyze_code_incremental(code, intent, str(session_id)))
+
+        prepared = prepare_submission(code)
+
+        # starting both model calls at once so latency is the slower of the two instead of the sum.
+        # in lazy mode only the graph skeleton is generated here, and explanations come from /api/get_explanation
+        started_at = time.monotonic()
+        if LAZY_EXPLANATIONS:
+            graph_future, = submit_admitted((analyze_graph, code, intent, prepared, True))
+            feedback_future = None
+        else:
+            graph_future, feedback_future = submit_admitted(
+                (analyze_graph, code, intent, prepared, False),
+                (analyze_explanation, code, intent, prepared),
+            )
 
         # generating a conceptual graph that scales to the code's complexity
-        conceptual_graph = generate_dynamic_conceptual_graph(code, intent, python_ast_context)
+        conceptual_graph, graph_error = wait_for_result(graph_future, started_at + GRAPH_DEADLINE_SECONDS)
+
+        if feedback_future is None:
+            if graph_error:
+                raise graph_error
+            prefetch_error_explanations(code, intent, conceptual_graph["nodes"])
+            return jsonify({"nodes": conceptual_graph["nodes"], "edges": conceptual_graph["edges"]})
 
         # generating simpler, conceptual explanation referencing the user's intent
-        high_level_feedback = get_conceptual_explanation(code, intent)
+        high_level_feedback, feedback_error = wait_for_result(feedback_future, started_at + EXPLANATION_DEADLINE_SECONDS)
+        # get_conceptual_explanation reports its failures as an error payload rather than raising
+        if not feedback_error and isinstance(high_level_feedback, dict) and "error" in high_level_feedback:
+            feedback_error = ValueError(high_level_feedback["error"])
 
-        return jsonify({
-            "nodes": conceptual_graph["nodes"],
-            "edges": conceptual_graph["edges"],
-            "high_level_feedback": high_level_feedback
-        })
+        if graph_error and feedback_error:
+            raise graph_error
+
+        response = {
+            "nodes": conceptual_graph["nodes"] if not graph_error else [],
+            "edges": conceptual_graph["edges"] if not graph_error else [],
+            "high_level_feedback": high_level_feedback if not feedback_error else {"error": str(feedback_error)},
+        }
+        # returning whatever finished, and flagging the half that didn't
+        if graph_error:
+            print(f"Returning explanation without graph: {graph_error}")
+            response["graph_error"] = str(graph_error)
+        return jsonify(response)
+    except LLMOverloaded as e:
+        return overloaded_response(e.retry_after)
     except ValueError as ve:
         print(f"ValueError occurred: {ve}")
         return jsonify({"error": str(ve)}), 500
@@ -51,104 +218,464 @@ def analyze_code():
         print(f"Error occurred: {e}")
         return jsonify({"error": "An unexpected error occurred."}), 500
 
-def robust_json_parse(response_text: str):
-    # this function attempts multiple parsing strategies (inspired by some tips on stack overflow https://stackoverflow.com/questions/956867)
-    # tries direct parse, regex extraction, substring extraction, and progressive line trimming
+@app.route("/api/analyze_code/stream", methods=["POST"])
+def analyze_code_stream():
+    # streaming variant of analyze_code: sends server-sent events (ref: https://html.spec.whatwg.org/multipage/server-sent-events.html)
+    # as the model generates them, so the canvas can fill in node by node instead of waiting for the full completion.
+    # events: node, edge, node_error, layout, graph_error, explanation_delta, explanation, done
+    print("Running analyze_code_stream function")
+    data = request.json
+    if not data or "code" not in data or "intent" not in data:
+        return jsonify({"error": "Missing code or intent in request body"}), 400
 
-    # this portion was partially generated with ChatGPT, while providing the above from StackOverflow for reference
+    code = data["code"]
+    intent = data["intent"]
+
+    retry_after = llm_limiter.reject_early()
+    if retry_after:
+        return overloaded_response(retry_after)
 
-    # --- phase 1: direct parse
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError:
-        pass
-
-    # --- phase 2: regex extraction
-    pattern = r"```(?:json)?\s*(\{[\s\S]*?\})\s*```|(\{[\s\S]*\})"
-    match = re.search(pattern, response_text)
-    if match:
-        json_candidate = match.group(1) or match.group(2)
-        json_candidate = json_candidate.strip('`')
+        prepared = prepare_submission(code)
+        python_ast_context = prepared["ast_context"]
+        code_fingerprint = prepared["fingerprint"]
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        return jsonify({"error": "An unexpected error occurred."}), 500
+
+    # both producers push (event, payload) pairs here; None marks one of them as finished
+    events = queue.Queue()
+    emit = lambda event, payload: events.put((event, payload))
+    started_at = time.monotonic()
+
+    def produce_graph():
         try:
-            return json.loads(json_candidate)
-        except json.JSONDecodeError as e:
-            print(f"Regex capture parse error: {e}")
-
-    # --- phase 3: substring extraction
-    start_index = response_text.find('{')
-    end_index = response_text.rfind('}') + 1
-    if start_index != -1 and end_index != -1 and end_index > start_index:
-        json_text = response_text[start_index:end_index]
+            key = make_cache_key("graph", code_fingerprint, intent, MODEL_NAME, PROMPT_VERSION)
+            conceptual_graph = response_cache.get(key)
+            if conceptual_graph is not None:
+                localize_graph_lines(conceptual_graph, prepared["statement_lines"])
+                for node in conceptual_graph["nodes"]:
+                    emit("node", node)
+                for edge in conceptual_graph["edges"]:
+                    emit("edge", edge)
+            else:
+                streamed = []
+
+                def stream_graph():
+                    streamed.append(True)
+                    graph = stream_conceptual_graph(
+                        code, intent, python_ast_context, emit, started_at + GRAPH_DEADLINE_SECONDS
+                    )
+                    apply_layout(graph["nodes"], graph["edges"])
+                    graph["statement_lines"] = prepared["statement_lines"]
+                    response_cache.set(key, graph)
+                    return graph
+
+                # if the same graph is already being generated for someone else, its result is replayed instead
+                conceptual_graph = localize_graph_lines(model_calls.do(key, stream_graph), prepared["statement_lines"])
+                if not streamed:
+                    for node in conceptual_graph["nodes"]:
+                        emit("node", node)
+                    for edge in conceptual_graph["edges"]:
+                        emit("edge", edge)
+            # nodes are sent before all edges are known, so their final positions follow in one event
+            emit("layout", {node.get("id"): node["position"] for node in conceptual_graph["nodes"]})
+        except Exception as e:
+            print(f"Error in streamed graph: {e}")
+            emit("graph_error", {"error": str(e)})
+        finally:
+            events.put(None)
+
+    def produce_explanation():
         try:
-            return json.loads(json_text)
-        except json.JSONDecodeError as e:
-            print(f"Substring parse error: {e}")
-            # --- phase 4: progressive line trimming
-            lines = json_text.split('\n')
-            while lines:
-                candidate = '\n'.join(lines)
-                try:
-                    return json.loads(candidate)
-                except json.JSONDecodeError:
-                    lines.pop()
-            return None
-    return None
+            key = make_cache_key("explanation", code_fingerprint, intent, MODEL_NAME, PROMPT_VERSION)
+            feedback = response_cache.get(key)
+            if feedback is None:
+                # a joined call doesn't replay explanation_delta events, only the final explanation below
+                feedback = model_calls.do(key, lambda: compute_and_cache(
+                    key, lambda: stream_conceptual_explanation(code, intent, emit, started_at + EXPLANATION_DEADLINE_SECONDS)
+                ))
+            emit("explanation", feedback)
+        except Exception as e:
+            # e.g. a joined call whose leader was rejected by the concurrency limit
+            print(f"Error in streamed explanation: {e}")
+            emit("explanation", {"error": str(e)})
+        finally:
+            events.put(None)
 
-def generate_dynamic_conceptual_graph(code, intent, python_ast_context):
-    # dynamically generate a conceptual graph with enough nodes to show distinct logic blocks
+    try:
+        # both producers hold a pool thread until the stream ends, so they're admitted like any other model call
+        submit_admitted((produce_graph,), (produce_explanation,))
+    except LLMOverloaded as e:
+        return overloaded_response(e.retry_after)
+
+    def generate():
+        remaining_producers = 2
+        while remaining_producers:
+            item = events.get()
+            if item is None:
+                remaining_producers -= 1
+                continue
+            yield sse_event(*item)
+        yield sse_event("done", {})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # stopping proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    ast_nodes_str = json.dumps(python_ast_context.get("nodes", []), indent=2)
-    ast_edges_str = json.dumps(python_ast_context.get("edges", []), indent=2)
+def submit_admitted(*calls):
+    # submits each (fn, *args) to llm_executor once the limiter has room for all of them (see
+    # ConcurrencyLimiter.reserve); raises LLMOverloaded otherwise, before anything is submitted
+    llm_limiter.reserve(len(calls))
+    futures = []
+    for fn, *args in calls:
+        future = submit_traced(llm_executor, fn, *args)
+        # also runs for calls cancelled at their deadline
+        future.add_done_callback(lambda _: llm_limiter.release())
+        futures.append(future)
+    return futures
+
+def overloaded_response(retry_after):
+    response = jsonify({"error": "The server is busy, please retry shortly.", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+def create_chat_completion(kind, **kwargs):
+    # every blocking model call goes through here so the global concurrency limit and the metrics cover all
+    # of them (stream_completion_text does the same for as long as its stream is open).
+    # kind labels the call in /metrics: graph, graph-skeleton, units, explanation or node
+    queued_at = time.monotonic()
+    with llm_limiter.slot():
+        MODEL_QUEUE_SECONDS.observe(time.monotonic() - queued_at)
+        PROMPT_CHARS.observe(sum(len(message["content"]) for message in kwargs["messages"]), kind=kind)
+        started_at = time.monotonic()
+        try:
+            completion = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            record_model_call(kind, time.monotonic() - started_at, error=e)
+            raise
+        record_model_call(kind, time.monotonic() - started_at, usage=getattr(completion, "usage", None))
+        return completion
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_completion_text(kind, messages, max_tokens, deadline):
+    # yields the completion text piece by piece (ref: https://platform.openai.com/docs/api-reference/streaming)
+    queued_at = time.monotonic()
+    with llm_limiter.slot():
+        MODEL_QUEUE_SECONDS.observe(time.monotonic() - queued_at)
+        PROMPT_CHARS.observe(sum(len(message["content"]) for message in messages), kind=kind)
+        started_at = time.monotonic()
+        first_token_seconds = None
+        usage = None
+        try:
+            stream = client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                temperature=0,
+                max_tokens=max_tokens,
+                timeout=max(0.0, deadline - time.monotonic()),
+                stream=True,
+                # the last chunk then carries the token usage, which streams otherwise don't report
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                if time.monotonic() > deadline:
+                    stream.close()
+                    raise TimeoutError("Model call did not finish before its deadline.")
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token_seconds is None:
+                        first_token_seconds = time.monotonic() - started_at
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            record_model_call(kind, time.monotonic() - started_at, usage, first_token_seconds, error=e)
+            raise
+        record_model_call(kind, time.monotonic() - started_at, usage, first_token_seconds)
+
+@app.route("/api/analyze_batch", methods=["POST"])
+def analyze_batch():
+    # batch mode for grading a whole class: takes {"submissions": [{id, code, intent}, ...]} (or the same objects
+    # as a jsonl body) and streams one jsonl result line per submission back, in completion order.
+    # identical normalized submissions are only analyzed once; see batch.py.
+    # to resume an interrupted batch, resend only the ids that didn't come back (cached ones return immediately)
+    print("Running analyze_batch function")
+    if request.is_json:
+        data = request.json
+        submissions = data.get("submissions") if isinstance(data, dict) else data
+    else:
+        try:
+            submissions = read_jsonl(request.get_data(as_text=True).splitlines())
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+    if not isinstance(submissions, list):
+        return jsonify({"error": "Expected a list of submissions"}), 400
+    retry_after = llm_limiter.reject_early()
+    if retry_after:
+        return overloaded_response(retry_after)
+
+    results = queue.Queue()
+
+    def run():
+        try:
+            run_batch(
+                submissions,
+                prepare=prepare_submission,
+                request_graph=analyze_graph,
+                request_explanation=lambda code, intent, prepared: analyze_explanation(code, intent, prepared, raise_errors=True),
+                on_result=results.put,
+                workers=BATCH_WORKERS,
+                # parsing inline: starting worker processes from the server per request costs more than it saves,
+                # and the pool is there for the command line, which runs much larger batches
+                processes=0,
+            )
+        except Exception as e:
+            print(f"Error in analyze_batch: {e}")
+            results.put({"error": str(e)})
+        finally:
+            results.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        while True:
+            result = results.get()
+            if result is None:
+                return
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/api/get_explanation", methods=["POST"])
+def get_explanation():
+    # on-demand explanations for lazy mode. with a "node" ({id, label, lines, has_error}) this explains that one
+    # step of the code; without one it returns the whole-program explanation for the feedback tab.
+    # both are cached, so reopening a node (or a classmate opening the same code) costs nothing
+    print("Running get_explanation function")
+    data = request.json
+    if not data or "code" not in data or "intent" not in data:
+        return jsonify({"error": "Missing code or intent in request body"}), 400
+
+    code = data["code"]
+    intent = data["intent"]
+    node = data.get("node")
+
+    retry_after = llm_limiter.reject_early()
+    if retry_after:
+        return overloaded_response(retry_after)
+
+    try:
+        if node is None:
+            feedback = analyze_explanation(code, intent, prepare_submission(code))
+            if "error" in feedback:
+                return jsonify({"error": feedback["error"]}), 500
+            return jsonify({"explanation": {"description": feedback.get("explanation", "")}})
+
+        if not isinstance(node, dict):
+            return jsonify({"error": "node must be an object"}), 400
+        description = get_node_explanation(code, intent, node)
+        return jsonify({"explanation": {"description": description}})
+    except LLMOverloaded as e:
+        return overloaded_response(e.retry_after)
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        return jsonify({"error": "An unexpected error occurred."}), 500
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    # hit/miss counters for the response cache
+    return jsonify(dict(
+        response_cache.snapshot(),
+        layout=layout_cache.snapshot(),
+        admission=llm_limiter.snapshot(),
+        single_flight=model_calls.snapshot(),
+    ))
+
+def prepare_submission(code):
+    # the cpu-only step before any model call: parsing the code with ast for more context
+    # (concept borrowed from https://docs.python.org/3/library/ast.html), building the prompt context and
+    # fingerprinting it for the cache. top-level so batch runs can send it to a process pool
+    with stage("parse"):
+        tree = ast.parse(code)
+    with stage("fingerprint"):
+        code_fingerprint = fingerprint_code(tree)
+        # the fingerprint ignores line numbers, so graphs shared between submissions are moved onto each one's own lines
+        lines = statement_lines(tree)
+    with stage("ast_context"):
+        ast_context = build_ast_context(tree)
+    return {"fingerprint": code_fingerprint, "ast_context": ast_context, "statement_lines": lines}
+
+def analyze_graph(code, intent, prepared, skeleton=False):
+    graph = cached_model_call(
+        "graph-skeleton" if skeleton else "graph", prepared["fingerprint"], intent,
+        lambda: dict(
+            generate_dynamic_conceptual_graph(code, intent, prepared["ast_context"], skeleton),
+            statement_lines=prepared["statement_lines"],
+        ),
+    )
+    localize_graph_lines(graph, prepared["statement_lines"]).pop("statement_lines")
+    return graph
+
+def analyze_explanation(code, intent, prepared, raise_errors=False):
+    # raise_errors lets batch runs see failures such as rate limits (and retry) instead of an error payload
+    explain = request_conceptual_explanation if raise_errors else get_conceptual_explanation
+    return cached_model_call("explanation", prepared["fingerprint"], intent, lambda: explain(code, intent))
+
+def cached_model_call(kind, code_fingerprint, intent, compute):
+    # serving a stored response when the same normalized code + intent was already analyzed,
+    # or joining the call for it if one is already running
+    key = make_cache_key(kind, code_fingerprint, intent, MODEL_NAME, PROMPT_VERSION)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    return model_calls.do(key, lambda: compute_and_cache(key, compute))
+
+def compute_and_cache(key, compute):
+    # checking again, since an identical call may have finished between the caller's lookup and joining
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    result = compute()
+    # error payloads are returned to this caller but never stored
+    if isinstance(result, dict) and "error" not in result:
+        response_cache.set(key, result)
+    return result
+
+def wait_for_result(future, deadline):
+    # waits for a submitted call until an absolute deadline, returning (result, error) instead of raising
+    # so one slow or failed call doesn't take the other one down with it
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic())), None
+    except FutureTimeoutError:
+        future.cancel()
+        return None, TimeoutError("Model call did not finish before its deadline.")
+    except Exception as e:
+        return None, e
+
+def robust_json_parse(response_text: str):
+    # single linear pass that skips fences/chatter, escapes raw newlines inside strings, and closes
+    # output that was cut off by max_tokens, keeping the longest valid prefix (see json_recovery.py).
+    # replaces the old direct/regex/substring/line-trimming chain, whose last phase was quadratic
+    with stage("json_parse"):
+        parsed, phase = recover_json(response_text)
+    JSON_PARSE_PHASES.inc(phase=phase or "none")
+    trace_event("json_parse", phase=phase)
+    if phase is None:
+        print("Could not recover a JSON object from the response.")
+    return parsed
+
+# instructions shared by the full and incremental graph prompts
+GRAPH_PROMPT_GUIDELINES = (
+    "You are an AI that generates a dynamic conceptual graph of the user's Python code. "
+    "Produce enough nodes to capture distinct logic blocks or conceptual chunks, but do not be too verbose with the nodes (i.e., create a node for every line)."
+    "Create just enough nodes so that the user can grasp the conceptual logic of their code without being overwhelmed by the details."
+    "If there's a conceptual mismatch, reference the specific line (e.g. 'if heap[index] > heap[parent]:') "
+    "AND attach the error message to the node that actually represents that logic step. "
+    "For example, if 'swap with parent' is the conceptual step where the code references 'if heap[index] > heap[parent]', "
+    "then the error belongs to the 'swap_parent' node, not just the entire push_heap function.\n\n"
+    "Error explanations should explain what conceptually happens in their incorrect code, and how that differs from their intent. It should NOT tell the user what they should do to fix the code. Emphasis on helping the user with conceptual understanding.\n"
+    "Error explanations must explain things through logic, rather than referring to abstract terms, or conditions the user may not be familiar with."
+    "For instance: 'When Z happens, X happens instead of Y.' Assume that the user is new to CS concepts, and always give concise, clear explanations.\n\n"
+)
+
+GRAPH_SYSTEM_MESSAGE = (
+    "You produce a dynamic conceptual graph, with 'just enough' nodes for conceptual clarity. "
+    "Nodes must reference code lines if mismatches exist, but do not overload with trivial nodes."
+)
+
+def build_graph_messages(code, intent, python_ast_context, skeleton=False):
+    # chat messages for the conceptual graph, shared by the blocking and streaming paths.
+    # a skeleton graph flags mismatching nodes instead of explaining them (see get_node_explanation)
+    if isinstance(python_ast_context, str):
+        ast_section = (
+            "Code outline (line numbers, nesting shown by indentation, '!!' marks a static check):\n"
+            f"{python_ast_context}"
+        )
+    else:
+        # compact separators instead of indent=2, which roughly doubled the prompt size for the same content
+        ast_nodes_str = json.dumps(python_ast_context.get("nodes", []), separators=(",", ":"))
+        ast_edges_str = json.dumps(python_ast_context.get("edges", []), separators=(",", ":"))
+        ast_section = f"AST Nodes:\n{ast_nodes_str}\n\nAST Edges:\n{ast_edges_str}"
+
+    if skeleton:
+        output_format = (
+            "Output only valid JSON with 'nodes' and 'edges'. Each node has 'id', 'label', 'lines' (the line numbers of the code it "
+            "represents, e.g. \"4-9\"), and 'error': true only when that step conceptually mismatches the user's intent. "
+            "Do not write the error explanations themselves; they are generated separately when the user opens a node. "
+        )
+    else:
+        output_format = (
+            "Output only valid JSON with 'nodes' and 'edges'. If you include errors, link them on the node that logically corresponds to the code line. "
+        )
 
     prompt = (
-        "You are an AI that generates a dynamic conceptual graph of the user's Python code. "
-        "Produce enough nodes to capture distinct logic blocks or conceptual chunks, but do not be too verbose with the nodes (i.e., create a node for every line)."
-        "Create just enough nodes so that the user can grasp the conceptual logic of their code without being overwhelmed by the details."
-        "If there's a conceptual mismatch, reference the specific line (e.g. 'if heap[index] > heap[parent]:') "
-        "AND attach the error message to the node that actually represents that logic step. "
-        "For example, if 'swap with parent' is the conceptual step where the code references 'if heap[index] > heap[parent]', "
-        "then the error belongs to the 'swap_parent' node, not just the entire push_heap function.\n\n"
-        "Error explanations should explain what conceptually happens in their incorrect code, and how that differs from their intent. It should NOT tell the user what they should do to fix the code. Emphasis on helping the user with conceptual understanding.\n"
-        "Error explanations must explain things through logic, rather than referring to abstract terms, or conditions the user may not be familiar with."
-        "For instance: 'When Z happens, X happens instead of Y.' Assume that the user is new to CS concepts, and always give concise, clear explanations.\n\n"
-        "Output only valid JSON with 'nodes' and 'edges'. If you include errors, link them on the node that logically corresponds to the code line. "
-        "Nodes should have position fields with small, close-together coordinates so related nodes appear visually near each other, "
-        "for example around (x: 100-300, y: 100-300). The user does NOT want nodes placed far apart.\n\n"
+        GRAPH_PROMPT_GUIDELINES +
+        output_format +
+        "Do not include node positions; the layout is computed separately.\n\n"
         "No code fences, no bullet points, no forced minimal or fixed node count. The final graph must be parseable.\n\n"
         f"User's intent:\n{intent}\n\n"
-        f"AST Nodes:\n{ast_nodes_str}\n\n"
-        f"AST Edges:\n{ast_edges_str}\n\n"
+        f"{ast_section}\n\n"
         f"User's code:\n```python\n{code}\n```"
     )
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-2024-11-20",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You produce a dynamic conceptual graph, with 'just enough' nodes for conceptual clarity. "
-                    "Nodes must reference code lines if mismatches exist, but do not overload with trivial nodes."
-                )
-            },
-            {"role": "user", "content": prompt},
-        ],
+    return [
+        {"role": "system", "content": GRAPH_SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt},
+    ]
+
+def generate_dynamic_conceptual_graph(code, intent, python_ast_context, skeleton=False):
+    # dynamically generate a conceptual graph with enough nodes to show distinct logic blocks
+    kind = "graph-skeleton" if skeleton else "graph"
+    with stage("prompt"):
+        messages = build_graph_messages(code, intent, python_ast_context, skeleton)
+    completion = create_chat_completion(
+        kind,
+        model=MODEL_NAME,
+        messages=messages,
         temperature=0,
         max_tokens=1600,
+        timeout=GRAPH_DEADLINE_SECONDS,
     )
 
     response_text = completion.choices[0].message.content.strip()
-    print("OpenAI API Response for Conceptual Graph:", response_text)
+    trace_event("response", kind=kind, text=response_text)
 
     conceptual_graph = robust_json_parse(response_text)
     if not conceptual_graph:
         raise ValueError("Failed to parse JSON object from the GPT response.")
 
-    nodes = conceptual_graph.get("nodes", [])
-    edges = conceptual_graph.get("edges", [])
+    with stage("postprocess"):
+        nodes, edges = drop_unfinished_items(conceptual_graph.get("nodes", []), conceptual_graph.get("edges", []))
+        attach_listed_errors(nodes, conceptual_graph.get("errors", []))
+        for node in nodes:
+            finalize_graph_node(node)
+    apply_layout(nodes, edges)
+
+    return {"nodes": nodes, "edges": edges}
 
+def is_complete_node(node):
+    return isinstance(node, dict) and node.get("id") is not None and bool(node.get("label"))
+
+def is_complete_edge(edge):
+    return isinstance(edge, dict) and edge.get("source") is not None and edge.get("target") is not None
+
+def drop_unfinished_items(nodes, edges):
+    # a response recovered after truncation can end in a node or edge that was cut off half-way
+    # (e.g. an edge with a source but no target); those would otherwise reach react flow and the cache
+    complete_nodes = [node for node in nodes if is_complete_node(node)]
+    complete_edges = [edge for edge in edges if is_complete_edge(edge)]
+    dropped = len(nodes) - len(complete_nodes) + len(edges) - len(complete_edges)
+    if dropped:
+        print(f"Dropped {dropped} unfinished nodes/edges from the model response")
+    return complete_nodes, complete_edges
+
+def attach_listed_errors(nodes, errors_list):
     # if there's a separate "errors" array, merge them into the corresponding nodes
-    errors_list = conceptual_graph.get("errors", [])
     for err_item in errors_list:
         err_node_id = err_item.get("id", "")
         err_desc = err_item.get("description", "")
@@ -157,91 +684,454 @@ def generate_dynamic_conceptual_graph(code, intent, python_ast_context):
                 node["error"] = err_desc
                 break
 
-    # convert node errors from object to string
-    for node in nodes:
-        node['position'] = {'x': 0, 'y': 0}
-        label_value = node.pop('label', '')
-        error_value = node.pop('error', None)
-
-        node['data'] = {'label': label_value}
-
-        if error_value:
-            if isinstance(error_value, dict):
-                # combine "line" and "message" into a single string
-                line_info = error_value.get("line", "")
-                msg_info = error_value.get("message", "")
-                combined_err = f"{line_info}\n{msg_info}" if line_info or msg_info else None
-                node['data']['error'] = combined_err
-            else:
-                node['data']['error'] = error_value
+def finalize_graph_node(node):
+    # reshape a model node into what react flow expects, converting node errors from object to string.
+    # the position is a placeholder until apply_layout runs on the whole graph
+    node['position'] = {'x': 0, 'y': 0}
+    label_value = node.pop('label', '')
+    error_value = node.pop('error', None)
+    lines_value = node.pop('lines', None)
+
+    node['data'] = {'label': label_value}
+
+    if lines_value:
+        node['data']['lines'] = lines_value
+    if error_value is True:
+        # skeleton graphs only flag the error; the explanation is fetched when the node is opened
+        node['data']['has_error'] = True
+    elif error_value:
+        node['data']['error'] = format_node_error(error_value)
 
-        node['type'] = 'customNode'
+    node['type'] = 'customNode'
+    return node
+
+def stream_conceptual_graph(code, intent, python_ast_context, emit, deadline):
+    # streaming counterpart of generate_dynamic_conceptual_graph: each node/edge is emitted as soon as its
+    # object closes in the model output. returns the assembled graph so it can be cached
+    item_stream = JsonArrayItemStream()
+    nodes_by_id = {}
+    nodes = []
+    edges = []
+    response_parts = []
+
+    def handle(array_key, item):
+        if not isinstance(item, dict):
+            return
+        if array_key == "nodes":
+            if not is_complete_node(item):
+                return
+            node = finalize_graph_node(item)
+            nodes.append(node)
+            nodes_by_id[node.get("id")] = node
+            emit("node", node)
+        elif array_key == "edges":
+            if not is_complete_edge(item):
+                return
+            edges.append(item)
+            emit("edge", item)
+        elif array_key == "errors":
+            # a separate "errors" array patches nodes that were already sent
+            node = nodes_by_id.get(item.get("id", ""))
+            if node is not None:
+                node["data"]["error"] = item.get("description", "")
+                emit("node_error", {"id": node["id"], "error": node["data"]["error"]})
+
+    with stage("prompt"):
+        messages = build_graph_messages(code, intent, python_ast_context)
+    for text in stream_completion_text("graph", messages, 1600, deadline):
+        response_parts.append(text)
+        for array_key, item in item_stream.feed(text):
+            handle(array_key, item)
+    trace_event("response", kind="graph", text="".join(response_parts).strip())
+
+    if not nodes:
+        # nothing closed while streaming (e.g. an unexpected shape), so fall back to parsing the whole response
+        conceptual_graph = robust_json_parse("".join(response_parts).strip())
+        if not conceptual_graph:
+            raise ValueError("Failed to parse JSON object from the GPT response.")
+        for array_key in ("nodes", "edges", "errors"):
+            for item in conceptual_graph.get(array_key, []):
+                handle(array_key, item)
 
     return {"nodes": nodes, "edges": edges}
 
+def apply_layout(nodes, edges, previous_positions=None):
+    # sets every node's position from a layered layout of the graph (see graph_layout.py). previous_positions
+    # (node id -> {"x", "y"}) keeps nodes that were already on screen in place across incremental updates.
+    # returns the positions by node id
+    node_ids = [node.get("id") for node in nodes]
+    node_count, pairs = graph_shape(node_ids, edges)
+    seeds = None
+    if previous_positions:
+        seeds = [
+            (previous_positions[node_id]["x"], previous_positions[node_id]["y"]) if node_id in previous_positions else None
+            for node_id in node_ids
+        ]
+
+    # seeded layouts depend on where the nodes were before, so only fresh layouts are shared by shape
+    key = shape_key(node_count, pairs) if not seeds else None
+    layout = layout_cache.get(key) if key else None
+    if layout is None:
+        with stage("layout"):
+            layout = layout_shape(node_count, pairs, seeds)
+        if key:
+            layout_cache.set(key, layout)
+
+    positions = {}
+    for node, (x, y) in zip(nodes, layout):
+        node["position"] = {"x": x, "y": y}
+        positions[node.get("id")] = node["position"]
+    return positions
+
+def format_node_error(error_value):
+    if isinstance(error_value, dict):
+        # combine "line" and "message" into a single string
+        line_info = error_value.get("line", "")
+        msg_info = error_value.get("message", "")
+        return f"{line_info}\n{msg_info}" if line_info or msg_info else None
+    return error_value
+
+def analyze_code_incremental(code, intent, session_id):
+    # re-analysis for a resubmission in the same session: the code is split into top-level functions/classes
+    # (plus module-level statements), diffed against the session's previous submission, and only the units
+    # that changed are sent to the model, together with the call sites that use them. unchanged units keep
+    # their previous subgraph and explanation, and node ids are prefixed by unit so they stay stable and the
+    # frontend can update the graph in place
+    tree = ast.parse(code)
+    units = split_units(code, tree)
+    normalized_intent = " ".join(intent.split())
+
+    session = session_store.get(session_id) or {}
+    # a different intent changes what every unit should be checked against
+    previous_units = session.get("units", {}) if session.get("intent") == normalized_intent else {}
+    changed, unchanged = diff_units(units, previous_units)
+    units_by_name = {unit["name"]: unit for unit in units}
+    # an unchanged unit can still have moved, e.g. when a function was added above it
+    records = {name: localize_graph_lines(previous_units[name], units_by_name[name]["statement_lines"]) for name in unchanged}
+
+    # a changed unit can still be in the shared cache, e.g. after reverting an edit
+    to_analyze = []
+    for unit in units:
+        if unit["name"] not in changed:
+            continue
+        cached = response_cache.get(unit_cache_key(unit, intent))
+        if cached is not None:
+            records[unit["name"]] = localize_graph_lines(dict(cached, fingerprint=unit["fingerprint"]), unit["statement_lines"])
+        else:
+            to_analyze.append(unit)
+
+    graph_error = None
+    if to_analyze:
+        try:
+            # sessions that reach the same state (e.g. everyone's first submission of the starter code) share one call
+            flight_key = "\x1f".join(
+                [unit_cache_key(unit, intent) for unit in to_analyze] +
+                sorted(f"{name}:{record['fingerprint']}" for name, record in records.items())
+            )
+            unit_records = model_calls.do(flight_key, lambda: generate_unit_graphs(code, intent, units, to_analyze, records))
+            for unit, record in zip(to_analyze, unit_records):
+                # a joined call may have come from another session whose copy of the unit sits on other lines
+                records[unit["name"]] = localize_graph_lines(record, unit["statement_lines"])
+                response_cache.set(unit_cache_key(unit, intent), records[unit["name"]])
+        except Exception as e:
+            if not records:
+                raise
+            print(f"Returning reused units without the changed ones: {e}")
+            graph_error = e
+
+    nodes, edges, explanation = merge_units(units, records)
+    positions = apply_layout(nodes, edges, session.get("positions"))
+
+    session_store.set(session_id, {"intent": normalized_intent, "units": records, "positions": positions})
+    analyzed_names = [unit["name"] for unit in to_analyze]
+    response = {
+        "nodes": nodes,
+        "edges": edges,
+        "high_level_feedback": {"explanation": explanation},
+        "session_id": session_id,
+        "reanalyzed_units": analyzed_names,
+        "reused_units": [unit["name"] for unit in units if unit["name"] not in analyzed_names],
+    }
+    if graph_error:
+        response["graph_error"] = str(graph_error)
+    return response
+
+def unit_cache_key(unit, intent):
+    # the unit name is part of the key because it's baked into the stored node ids
+    return make_cache_key(f"unit:{unit['name']}", unit["fingerprint"], intent, MODEL_NAME, PROMPT_VERSION)
+
+def build_unit_graph_messages(code, intent, units, to_analyze, records):
+    # chat messages for the incremental graph: the changed units in full, everything else only as context
+    analyzed_names = {unit["name"] for unit in to_analyze}
+    changed_section = "\n\n".join(f"Unit '{unit['name']}':\n{unit['source']}" for unit in to_analyze)
+    context_lines = [unit["source"].split("\n", 1)[0] for unit in units if unit["name"] not in analyzed_names]
+    call_sites = find_call_sites(code, units, analyzed_names)
+    existing_nodes = [
+        f"{node['id']}: {node['data'].get('label', '')}"
+        for record in records.values()
+        for node in record["nodes"]
+    ]
+
+    prompt = (
+        GRAPH_PROMPT_GUIDELINES +
+        "The user is editing their code and only some units changed since the last analysis. "
+        "Produce nodes only for the changed units below.\n"
+        "Output only valid JSON: {\"nodes\": [...], \"edges\": [...], \"explanations\": {\"<unit name>\": \"...\"}}. "
+        "Every node needs 'id', 'label' and 'unit' (the name of the changed unit it belongs to), plus 'error' if there is a mismatch. "
+        "Node ids must be unique across all changed units, so start each id with its unit's name (e.g. 'push_entry'). "
+        "Edges may also connect to the existing nodes listed below, using their ids exactly. "
+        "'explanations' has one short conceptual explanation per changed unit, comparing its logic to the user's intent, "
+        "using a bullet point for each line you're referencing.\n"
+        "No code fences. The final output must be parseable.\n\n"
+        f"User's intent:\n{intent}\n\n"
+        f"Changed units:\n{changed_section}\n\n"
+    )
+    if context_lines:
+        prompt += "Unchanged units (context only):\n" + "\n".join(context_lines) + "\n\n"
+    if call_sites:
+        prompt += "Calls to the changed units:\n" + "\n".join(call_sites) + "\n\n"
+    if existing_nodes:
+        prompt += "Existing nodes:\n" + "\n".join(existing_nodes) + "\n"
+
+    return [
+        {"role": "system", "content": GRAPH_SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt},
+    ]
+
+def generate_unit_graphs(code, intent, units, to_analyze, records):
+    # one model call for all changed units; returns a record per unit in to_analyze order
+    with stage("prompt"):
+        messages = build_unit_graph_messages(code, intent, units, to_analyze, records)
+    completion = create_chat_completion(
+        "units",
+        model=MODEL_NAME,
+        messages=messages,
+        temperature=0,
+        max_tokens=1600,
+        timeout=GRAPH_DEADLINE_SECONDS,
+    )
+
+    response_text = completion.choices[0].message.content.strip()
+    trace_event("response", kind="units", text=response_text)
+
+    conceptual_graph = robust_json_parse(response_text)
+    if not conceptual_graph:
+        raise ValueError("Failed to parse JSON object from the GPT response.")
+
+    existing_node_ids = {node["id"] for record in records.values() for node in record["nodes"]}
+    unit_names = [unit["name"] for unit in to_analyze]
+    with stage("postprocess"):
+        nodes, edges = drop_unfinished_items(conceptual_graph.get("nodes", []), conceptual_graph.get("edges", []))
+        attach_listed_errors(nodes, conceptual_graph.get("errors", []))
+        subgraphs = namespace_unit_graph(nodes, edges, unit_names, existing_node_ids)
+        for subgraph in subgraphs.values():
+            for node in subgraph["nodes"]:
+                finalize_graph_node(node)
+
+    explanations = conceptual_graph.get("explanations") or {}
+    unit_records = []
+    for unit in to_analyze:
+        subgraph = subgraphs[unit["name"]]
+        explanation = explanations.get(unit["name"]) if isinstance(explanations, dict) else None
+        unit_records.append({
+            "fingerprint": unit["fingerprint"],
+            "statement_lines": unit["statement_lines"],
+            "nodes": subgraph["nodes"],
+            "edges": subgraph["edges"],
+            "explanation": explanation if isinstance(explanation, str) else "",
+        })
+    return unit_records
+
+def parse_node_lines(lines_value):
+    # the model writes line spans as "4-9", "4, 7", 4 or [4, 9]; returns the sorted line numbers
+    if isinstance(lines_value, int):
+        return [lines_value]
+    if isinstance(lines_value, list):
+        numbers = [n for n in lines_value if isinstance(n, int)]
+        if len(numbers) == 2 and numbers[0] < numbers[1]:
+            return list(range(numbers[0], numbers[1] + 1))
+        return sorted(numbers)
+    numbers = set()
+    for part in str(lines_value or "").replace(";", ",").split(","):
+        bounds = [b.strip() for b in part.split("-")]
+        if all(b.isdigit() for b in bounds) and 1 <= len(bounds) <= 2:
+            numbers.update(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return sorted(numbers)
+
+def format_node_lines(numbers):
+    # sorted line numbers back to the model's "4-9, 12" form
+    spans = []
+    for number in numbers:
+        if spans and number == spans[-1][1] + 1:
+            spans[-1][1] = number
+        else:
+            spans.append([number, number])
+    return ", ".join(f"{start}-{end}" if start != end else str(start) for start, end in spans)
+
+def remap_node_lines(lines_value, source_statements, target_statements):
+    # moves a line span from the code a response was generated for onto code with the same fingerprint
+    # (see response_cache.statement_lines): each line is anchored to the innermost statement containing it and
+    # keeps its offset into that statement. lines outside every statement (comments, blank lines) are dropped
+    if len(source_statements) != len(target_statements):
+        return None
+    remapped = set()
+    for number in parse_node_lines(lines_value):
+        containing = [(start, index) for index, (start, end) in enumerate(source_statements) if start <= number <= end]
+        if not containing:
+            continue
+        # the statement starting last is the innermost; on a tie, ast.walk lists the nested one later
+        start, index = max(containing)
+        target_start, target_end = target_statements[index]
+        remapped.add(min(target_start + number - start, target_end))
+    return format_node_lines(sorted(remapped)) or None
+
+def localize_graph_lines(graph, statements):
+    # moves the node lines of a graph (or unit record) generated for one submission onto the code with these
+    # statements, in place. graph["statement_lines"] says which code the lines currently point into
+    source = graph.get("statement_lines")
+    if source is not None and source != statements:
+        for node in graph.get("nodes", []):
+            data = node.get("data", {})
+            if "lines" in data:
+                lines_value = remap_node_lines(data["lines"], source, statements)
+                if lines_value:
+                    data["lines"] = lines_value
+                else:
+                    data.pop("lines")
+    graph["statement_lines"] = statements
+    return graph
+
+def node_code_span(code, node):
+    # the (line number, source line) pairs a node covers, which is what its explanation is really about
+    code_lines = code.splitlines()
+    return [(n, code_lines[n - 1]) for n in parse_node_lines(node.get("lines")) if 1 <= n <= len(code_lines)]
+
+def node_explanation_key(code, intent, node):
+    # keyed on the node's code span (whitespace-insensitive) rather than the whole file, so the explanation is
+    # reused across resubmissions that didn't touch those lines. nodes without a span fall back to the label
+    # plus the whole code. line numbers aren't part of the key, so code moving down a few lines still hits
+    span = "\n".join(line for _, line in node_code_span(code, node))
+    basis = " ".join(span.split()) if span else f"{node.get('label', '')}\x1f{' '.join(code.split())}"
+    span_hash = hashlib.sha256(basis.encode("utf-8")).hexdigest()
+    return make_cache_key(f"node:{bool(node.get('has_error'))}", span_hash, intent, MODEL_NAME, PROMPT_VERSION)
+
+def get_node_explanation(code, intent, node, key=None):
+    key = key or node_explanation_key(code, intent, node)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached["description"]
+
+    # a click that lands while the prefetch for the same node is running waits for it instead of calling again
+    return model_calls.do(key, lambda: generate_node_explanation(code, intent, node, key))
+
+def prefetch_error_explanations(code, intent, nodes):
+    # speculatively generating explanations for flagged nodes, since those are the ones users open first.
+    # skipped while model calls are queueing, so speculation never delays or rejects real requests
+    if llm_limiter.busy():
+        return
+    flagged = [node["data"] for node in nodes if node.get("data", {}).get("has_error")]
+    for node in flagged[:PREFETCH_ERROR_EXPLANATIONS]:
+        key = node_explanation_key(code, intent, node)
+        if response_cache.get(key) is None:
+            try:
+                submit_admitted((get_node_explanation, code, intent, node, key))
+            except LLMOverloaded:
+                return
+
+def generate_node_explanation(code, intent, node, key):
+    span = "\n".join(f"{n:>4} | {line}" for n, line in node_code_span(code, node))
+    numbered_code = "\n".join(f"{n:>4} | {line}" for n, line in enumerate(code.splitlines(), start=1))
+    focus = (
+        "This step conceptually mismatches the user's intent. Explain what conceptually happens in this code, and how that differs "
+        "from their intent, e.g. 'When Z happens, X happens instead of Y.' Do NOT tell the user how to fix it."
+        if node.get("has_error") else
+        "Explain what this step does and how it contributes to the user's intent."
+    )
+    prompt = (
+        "You are a conceptual logic tutor. The user clicked one step of a conceptual graph of their Python code. "
+        f"{focus} Explain through logic rather than abstract terms, assume the user is new to CS, and keep it to a few "
+        "concise sentences or bullet points in markdown.\n\n"
+        f"User's intent:\n{intent}\n\n"
+        f"Step: {node.get('label', '')}\n"
+        + (f"Lines for this step:\n{span}\n\n" if span else "\n")
+        + f"Full code for context:\n{numbered_code}"
+    )
+    completion = create_chat_completion(
+        "node",
+        model=MODEL_NAME,
+        messages=[
+            {"role": "system", "content": "You explain one step of the user's code in plain, friendly language. No fix instructions."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+        max_tokens=300,
+        timeout=EXPLANATION_DEADLINE_SECONDS,
+    )
+    description = completion.choices[0].message.content.strip()
+    trace_event("response", kind="node", text=description)
+    response_cache.set(key, {"description": description})
+    return description
+
+def build_ast_context(tree):
+    # the ast description that goes into the graph prompt
+    if AST_CONTEXT_MODE == "full":
+        return analyze_code_tree(tree)
+    return summarize_code_tree(tree, token_budget=AST_TOKEN_BUDGET)
+
 def analyze_code_tree(tree):
-    # ast-based structure to give gpt deeper context, not used directly in the final graph
+    # ast-based structure to give gpt deeper context, not used directly in the final graph.
+    # walks the tree in one iterative pre-order pass with an explicit stack (rather than recursing through
+    # generic_visit), so deeply nested submissions can't hit the recursion limit
     nodes = []
     edges = []
-    node_id = 0
-
-    class CodeVisitor(ast.NodeVisitor):
-        def __init__(self):
-            self.parent_stack = []
-            self.current_function_name = None
-
-        def generic_visit(self, node):
-            nonlocal node_id
-            current_node_id = str(node_id)
-            node_label = self.get_node_label(node)
-            error = self.detect_errors(node)
-
-            node_info = {
-                "id": current_node_id,
-                "node_type": type(node).__name__,
-                "label": node_label,
-                "error": error
-            }
-            nodes.append(node_info)
-
-            if self.parent_stack:
-                parent_id = self.parent_stack[-1]
-                edges.append({
-                    "id": f"e{parent_id}-{current_node_id}",
-                    "source": parent_id,
-                    "target": current_node_id,
-                })
-
-            self.parent_stack.append(current_node_id)
-            node_id += 1
-            super().generic_visit(node)
-            self.parent_stack.pop()
-
-        def get_node_label(self, node):
-            if isinstance(node, ast.FunctionDef):
-                return f"FunctionDef: {node.name}"
-            elif isinstance(node, ast.ClassDef):
-                return f"ClassDef: {node.name}"
-            return type(node).__name__
-
-        def detect_errors(self, node):
-            # checking for empty function or recursive calls, just as an example
-            if isinstance(node, ast.FunctionDef):
-                if len(node.body) == 0:
-                    return "Empty function."
-                self.current_function_name = node.name
-            elif isinstance(node, ast.Call):
-                func_name = ast.unparse(node.func)
-                if func_name == self.current_function_name:
-                    return "Recursive call detected."
-            return None
-
-    visitor = CodeVisitor()
-    visitor.visit(tree)
+
+    # each entry is (ast node, parent id, name of the enclosing function)
+    stack = [(tree, None, None)]
+    while stack:
+        node, parent_id, function_name = stack.pop()
+        current_node_id = str(len(nodes))
+
+        nodes.append({
+            "id": current_node_id,
+            "node_type": type(node).__name__,
+            "label": get_node_label(node),
+            "error": detect_node_error(node, function_name),
+        })
+        if parent_id is not None:
+            edges.append({
+                "id": f"e{parent_id}-{current_node_id}",
+                "source": parent_id,
+                "target": current_node_id,
+            })
+
+        if isinstance(node, ast.FunctionDef):
+            function_name = node.name
+        # pushing children reversed so they come off the stack in source order
+        children = list(ast.iter_child_nodes(node))
+        stack.extend((child, current_node_id, function_name) for child in reversed(children))
+
     return {"nodes": nodes, "edges": edges}
 
-def get_conceptual_explanation(code, intent):
-    # provide a single json object with 'explanation' referencing the user's intent
+def get_node_label(node):
+    if isinstance(node, ast.FunctionDef):
+        return f"FunctionDef: {node.name}"
+    elif isinstance(node, ast.ClassDef):
+        return f"ClassDef: {node.name}"
+    return type(node).__name__
+
+def detect_node_error(node, function_name):
+    # checking for empty function or recursive calls, just as an example
+    if isinstance(node, ast.FunctionDef):
+        if len(node.body) == 0:
+            return "Empty function."
+    elif isinstance(node, ast.Call):
+        func_name = ast.unparse(node.func)
+        if func_name == function_name:
+            return "Recursive call detected."
+    return None
+
+def build_explanation_messages(code, intent):
+    # chat messages for the high-level explanation, shared by the blocking and streaming paths
     prompt = (
         "You are a conceptual logic tutor. Provide a single JSON object {\"explanation\": \"...\"} "
         "focusing on how this code conceptually aligns or misaligns with the user's intent. "
@@ -256,55 +1146,77 @@ def get_conceptual_explanation(code, intent):
         f"Code:\n```python\n{code}\n```"
     )
 
-    try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-2024-11-20",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Output only {\"explanation\":\"...\"}, referencing user intent and code lines. "
-                        "No bullet points, no fix instructions."
-                    )
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0,
-            max_tokens=600,
-        )
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Output only {\"explanation\":\"...\"}, referencing user intent and code lines. "
+                "No bullet points, no fix instructions."
+            )
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+def request_conceptual_explanation(code, intent):
+    # provide a single json object with 'explanation' referencing the user's intent
+    with stage("prompt"):
+        messages = build_explanation_messages(code, intent)
+    completion = create_chat_completion(
+        "explanation",
+        model=MODEL_NAME,
+        messages=messages,
+        temperature=0,
+        max_tokens=600,
+        timeout=EXPLANATION_DEADLINE_SECONDS,
+    )
 
-        response_text = completion.choices[0].message.content.strip()
-        print("OpenAI API Response (High-Level Explanation):", response_text)
+    response_text = completion.choices[0].message.content.strip()
+    trace_event("response", kind="explanation", text=response_text)
+    return parse_explanation_text(response_text)
+
+def get_conceptual_explanation(code, intent):
+    # same as request_conceptual_explanation, but failures come back as an error payload
+    try:
+        return request_conceptual_explanation(code, intent)
+    except LLMOverloaded:
+        # surfaced as a 429 rather than as an explanation that failed
+        raise
+    except Exception as e:
+        print(f"Error in get_conceptual_explanation: {e}")
+        return {"error": str(e)}
 
+def parse_explanation_text(response_text):
+    # raw newlines inside the explanation string are escaped by robust_json_parse itself
+    feedback = robust_json_parse(response_text)
+    if feedback is None:
+        print("Could not parse the explanation JSON. Returning raw text.")
         # strip any code fences
         if response_text.startswith("```") and response_text.endswith("```"):
             response_text = response_text.strip("`").strip()
             if response_text.lower().startswith("json"):
                 response_text = response_text[4:].strip()
+        feedback = {"explanation": response_text}
 
-        # --- NEW STEP: attempt to escape unescaped newlines within quoted strings
-        # this uses regex that finds text between quotes and replaces raw newlines with \n
-        # so that it's valid JSON
-        def escape_newlines_in_quoted_strings(m: re.Match):
-            content = m.group(0)
-            # replace unescaped newlines with \n
-            content = content.replace("\n", "\\n")
-            return content
-
-        # this regex matches any double-quoted string (including the quotes)
-        # note: DOESNT handle every JSON edge case perfectly, but works well for typical multiline GPT outputs
-        quoted_string_pattern = r'"([^"\\]*(\\.[^"\\]*)*)"'
-        sanitized_response = re.sub(quoted_string_pattern, escape_newlines_in_quoted_strings, response_text)
-
-        feedback = robust_json_parse(sanitized_response)
-        if feedback is None:
-            print("Could not parse the explanation JSON even after newline escaping. Returning raw text.")
-            feedback = {"explanation": response_text}
-
-        return feedback
+    return feedback
 
+def stream_conceptual_explanation(code, intent, emit, deadline):
+    # streaming counterpart of get_conceptual_explanation: emits the explanation text as it is generated,
+    # then returns the fully parsed feedback object
+    field_stream = JsonStringFieldStream("explanation")
+    response_parts = []
+    try:
+        with stage("prompt"):
+            messages = build_explanation_messages(code, intent)
+        for text in stream_completion_text("explanation", messages, 600, deadline):
+            response_parts.append(text)
+            delta = field_stream.feed(text)
+            if delta:
+                emit("explanation_delta", {"text": delta})
+        response_text = "".join(response_parts).strip()
+        trace_event("response", kind="explanation", text=response_text)
+        return parse_explanation_text(response_text)
     except Exception as e:
-        print(f"Error in get_conceptual_explanation: {e}")
+        print(f"Error in stream_conceptual_explanation: {e}")
         return {"error": str(e)}
 
 
@@ -0,0 +1,164 @@
+import ast
+
+# rough chars-per-token for code, close enough to budget prompt size without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# statement kinds, from most to least important to keep when the outline has to shrink
+_STRUCTURE, _CONTROL, _DETAIL = 0, 1, 2
+
+_BLOCK_FIELDS = ("body", "handlers", "orelse", "finalbody", "cases")
+
+
+def summarize_code_tree(tree, token_budget=1500):
+    # compact outline of the program for the graph prompt: one line per statement, nesting by indentation,
+    # compound statements reduced to their header and expressions to their source text, e.g.
+    #   1-9: def push_heap(heap, value)
+    #     2: heap.append(value)
+    #     4-9: while index > 0
+    #       6: if heap[index] > heap[parent]  !! ...
+    # load/store contexts, names and constants never become entries of their own.
+    # if the outline is over token_budget it degrades in steps: shorter expression text, then dropping
+    # plain statements, then control flow (deepest first), keeping function/class structure for last
+    entries = _collect_entries(tree)
+
+    for clip in (80, 40):
+        lines = [_render(entry, clip) for entry in entries]
+        if _estimate_tokens(lines) <= token_budget:
+            return "\n".join(lines)
+
+    # dropping the least important, most deeply nested statements until the outline fits
+    lines = [_render(entry, 40) for entry in entries]
+    total = _estimate_tokens(lines)
+    removal_order = sorted(range(len(entries)), key=lambda i: (-entries[i]["priority"], -entries[i]["depth"], -i))
+    kept = [True] * len(entries)
+    omitted = 0
+    for i in removal_order:
+        if total <= token_budget or entries[i]["priority"] == _STRUCTURE:
+            break
+        kept[i] = False
+        total -= _estimate_tokens([lines[i]])
+        omitted += 1
+
+    summary = [line for line, keep in zip(lines, kept) if keep]
+    # last resort for very large files: cutting the structure-only outline off at the budget
+    while summary and _estimate_tokens(summary) > token_budget:
+        omitted += 1
+        summary.pop()
+    summary.append(f"({omitted} statements omitted to fit the token budget)")
+    return "\n".join(summary)
+
+
+def _estimate_tokens(lines):
+    return sum(len(line) // CHARS_PER_TOKEN + 1 for line in lines)
+
+
+def _render(entry, clip):
+    text = entry["text"]
+    if len(text) > clip:
+        text = text[: clip - 3] + "..."
+    span = entry["span"]
+    issue = f"  !! {entry['issue']}" if entry["issue"] else ""
+    return f"{'  ' * entry['depth']}{span}: {text}{issue}"
+
+
+def _collect_entries(tree):
+    # single iterative pass over statements (an explicit stack instead of recursing through visit methods,
+    # so deeply nested code can't hit the recursion limit).
+    # stack items are (node, depth, enclosing function name, keyword) where keyword is "elif" for elif
+    # branches, or "else"/"finally" for header lines that have no node of their own (node is then the first
+    # statement of that block, used for the line number)
+    entries = []
+    stack = [(stmt, 0, None, None) for stmt in reversed(tree.body)]
+    while stack:
+        node, depth, function_name, keyword = stack.pop()
+
+        if keyword in ("else", "finally"):
+            entries.append({"text": keyword, "span": str(node.lineno), "depth": depth, "priority": _CONTROL, "issue": None})
+            continue
+
+        text, priority = _describe(node, keyword)
+        issue = _detect_issue(node, function_name)
+        if issue:
+            priority = _STRUCTURE
+        entries.append({"text": text, "span": _span(node), "depth": depth, "priority": priority, "issue": issue})
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            function_name = node.name
+
+        # collecting child blocks in source order, then pushing them reversed so they pop in source order
+        children = []
+        for field in _BLOCK_FIELDS:
+            block = getattr(node, field, None)
+            if not block:
+                continue
+            if field == "orelse" and isinstance(node, ast.If) and len(block) == 1 and isinstance(block[0], ast.If):
+                # elif chains stay at the same depth as the if
+                children.append((block[0], depth, function_name, "elif"))
+                continue
+            if field in ("orelse", "finalbody"):
+                children.append((block[0], depth, function_name, "else" if field == "orelse" else "finally"))
+            children.extend((child, depth + 1, function_name, None) for child in block)
+        stack.extend(reversed(children))
+    return entries
+
+
+def _span(node):
+    start = getattr(node, "lineno", None)
+    end = getattr(node, "end_lineno", None)
+    if start is None:
+        return "?"
+    return f"{start}-{end}" if end and end != start else f"{start}"
+
+
+def _describe(node, keyword=None):
+    # returns (one-line text, priority) for a statement-level node
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+        return f"{prefix} {node.name}({ast.unparse(node.args)})", _STRUCTURE
+    if isinstance(node, ast.ClassDef):
+        bases = ", ".join(ast.unparse(base) for base in node.bases)
+        return f"class {node.name}({bases})" if bases else f"class {node.name}", _STRUCTURE
+    if isinstance(node, (ast.For, ast.AsyncFor)):
+        return f"for {ast.unparse(node.target)} in {ast.unparse(node.iter)}", _CONTROL
+    if isinstance(node, ast.While):
+        return f"while {ast.unparse(node.test)}", _CONTROL
+    if isinstance(node, ast.If):
+        return f"{keyword or 'if'} {ast.unparse(node.test)}", _CONTROL
+    if isinstance(node, (ast.With, ast.AsyncWith)):
+        return f"with {', '.join(ast.unparse(item) for item in node.items)}", _CONTROL
+    if isinstance(node, ast.Try) or type(node).__name__ == "TryStar":
+        return "try", _CONTROL
+    if isinstance(node, ast.ExceptHandler):
+        caught = f" {ast.unparse(node.type)}" if node.type else ""
+        alias = f" as {node.name}" if node.name else ""
+        return f"except{caught}{alias}", _CONTROL
+    if isinstance(node, ast.Match):
+        return f"match {ast.unparse(node.subject)}", _CONTROL
+    if isinstance(node, ast.match_case):
+        return f"case {ast.unparse(node.pattern)}", _CONTROL
+    if isinstance(node, (ast.Return, ast.Raise, ast.Break, ast.Continue)):
+        return ast.unparse(node), _CONTROL
+    # assignments, expression statements (calls), imports and the rest collapse to their source text
+    return ast.unparse(node).split("\n", 1)[0], _DETAIL
+
+
+def _detect_issue(node, function_name):
+    # same static checks as analyze_code_tree: empty functions and direct recursion
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.body:
+        return "Empty function."
+    if function_name:
+        for sub in ast.walk(node) if not hasattr(node, "body") else _header_expressions(node):
+            if isinstance(sub, ast.Call) and ast.unparse(sub.func) == function_name:
+                return "Recursive call detected."
+    return None
+
+
+def _header_expressions(node):
+    # the parts of a compound statement that aren't nested statements (its test, iterator, items, ...)
+    for field, value in ast.iter_fields(node):
+        if field in _BLOCK_FIELDS:
+            continue
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if isinstance(item, ast.AST):
+                yield from ast.walk(item)
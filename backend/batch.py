@@ -0,0 +1,270 @@
+"""Batch analysis for a whole class's submissions.
+
+Reads JSONL of {"id", "code", "intent"} and writes one JSONL result per submission:
+    python batch.py submissions.jsonl -o results.jsonl
+
+Rerunning the same command after a crash skips every id already completed in the output
+(or --checkpoint) file, so only the remaining submissions are analyzed.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from openai import RateLimitError
+
+from admission import LLMOverloaded
+
+# below this many submissions, parsing inline is faster than starting a process pool
+PROCESS_POOL_MIN_SUBMISSIONS = 32
+
+
+class RateLimitGate:
+    # shared by every worker in a batch: when any model call gets a 429 (or the server's own concurrency limit
+    # turns it away), all workers hold off until the retry-after (or an exponential backoff with jitter) has
+    # passed, instead of each one hammering the api on its own schedule
+
+    def __init__(self, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            self._wait()
+            try:
+                return fn(*args)
+            except (RateLimitError, LLMOverloaded) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_after(e) or min(self.max_delay, self.base_delay * 2 ** attempt)
+                delay *= 1 + random.random() * 0.25
+                print(f"Rate limited, pausing batch workers for {delay:.1f}s (attempt {attempt + 1})")
+                with self._lock:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _wait(self):
+        with self._lock:
+            remaining = self._paused_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    @staticmethod
+    def _retry_after(error):
+        if isinstance(error, LLMOverloaded):
+            return error.retry_after
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+
+def read_jsonl(lines):
+    submissions = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            submissions.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}")
+    return submissions
+
+
+def _prepare_safely(prepare, code):
+    # runs in the process pool; a syntax error in one submission shouldn't fail the whole map
+    try:
+        return prepare(code)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def _prepare_all(prepare, codes, processes):
+    if processes == 0 or len(codes) < PROCESS_POOL_MIN_SUBMISSIONS:
+        return [_prepare_safely(prepare, code) for code in codes]
+    try:
+        # spawn rather than fork: forking a process that has other threads running can copy a lock one of them
+        # holds (sqlite, metrics, executor queues) into the child, where nothing will ever release it
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return list(pool.map(_prepare_safely, [prepare] * len(codes), codes, chunksize=16))
+    except Exception as e:
+        print(f"Process pool unavailable ({e}), parsing submissions inline")
+        return [_prepare_safely(prepare, code) for code in codes]
+
+
+def run_batch(submissions, prepare, request_graph, request_explanation, on_result,
+              workers=4, processes=None, skip_ids=(), gate=None):
+    # analyzes a list of {id, code, intent} submissions, calling on_result(result) once per submission.
+    #   prepare(code) -> {"fingerprint", "ast_context"}       cpu-only, runs across a process pool (processes=0 parses
+    #                                                         inline); must be importable by name in a fresh process
+    #   request_graph(code, intent, prepared) -> graph         model call, raises on failure
+    #   request_explanation(code, intent, prepared) -> dict    model call, raises on failure
+    # submissions that normalize to the same code and intent share a single pair of model calls.
+    # on_result is only ever called from the calling thread
+    gate = gate or RateLimitGate()
+
+    pending = []
+    for submission in submissions:
+        if not isinstance(submission, dict) or not all(k in submission for k in ("id", "code", "intent")):
+            submission_id = submission.get("id") if isinstance(submission, dict) else None
+            on_result({"id": submission_id, "error": "Missing id, code or intent"})
+        elif submission["id"] not in skip_ids:
+            pending.append(submission)
+
+    prepared_list = _prepare_all(prepare, [s["code"] for s in pending], processes)
+
+    # grouping identical normalized submissions: key -> (first submission, prepared, all ids)
+    groups = {}
+    for submission, prepared in zip(pending, prepared_list):
+        if "error" in prepared:
+            on_result({"id": submission["id"], "error": prepared["error"]})
+            continue
+        # submissions on different lines aren't grouped, since the graph's line spans differ; they still share the
+        # model calls through the response cache
+        key = (prepared["fingerprint"], json.dumps(prepared.get("statement_lines")), " ".join(submission["intent"].split()))
+        groups.setdefault(key, (submission, prepared, []))[2].append(submission["id"])
+
+    if groups:
+        print(f"Analyzing {len(groups)} distinct submissions out of {len(pending)}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # future -> (group key, "graph" | "explanation")
+        futures = {}
+        for key, (submission, prepared, _) in groups.items():
+            args = (submission["code"], submission["intent"], prepared)
+            futures[pool.submit(gate.call, request_graph, *args)] = (key, "graph")
+            futures[pool.submit(gate.call, request_explanation, *args)] = (key, "explanation")
+
+        partial = {}
+        for future in as_completed(futures):
+            key, part = futures[future]
+            partial.setdefault(key, {})[part] = future
+            if len(partial[key]) < 2:
+                continue
+            result = _combine(partial.pop(key))
+            for submission_id in groups[key][2]:
+                on_result({"id": submission_id, **result})
+
+
+def _combine(parts):
+    # same response shape as /api/analyze_code, including a partial result if one half failed
+    result = {}
+    try:
+        graph = parts["graph"].result()
+        result["nodes"] = graph["nodes"]
+        result["edges"] = graph["edges"]
+    except Exception as e:
+        result["nodes"] = []
+        result["edges"] = []
+        result["graph_error"] = str(e)
+    try:
+        result["high_level_feedback"] = parts["explanation"].result()
+    except Exception as e:
+        result["high_level_feedback"] = {"error": str(e)}
+    return result
+
+
+def is_complete(result):
+    # failed results are written out but not treated as done, so a rerun retries them
+    feedback = result.get("high_level_feedback") or {}
+    return "error" not in result and "graph_error" not in result and "error" not in feedback
+
+
+def load_completed_ids(path):
+    # reads a previous run's output; a half-written last line from a crash is ignored
+    completed = set()
+    if not path or not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(result, dict) and is_complete(result):
+                completed.add(result.get("id"))
+    return completed
+
+
+def open_for_append(path):
+    # making sure a crash mid-line doesn't glue the next result onto the broken one
+    needs_newline = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    f = open(path, "a", encoding="utf-8")
+    if needs_newline:
+        f.write("\n")
+    return f
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a JSONL file of {id, code, intent} submissions.")
+    parser.add_argument("input", help="JSONL file of submissions, or - for stdin")
+    parser.add_argument("-o", "--output", help="file to append JSONL results to (default: stdout)")
+    parser.add_argument("--checkpoint", help="file recording completed results (default: the output file)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("FLEX_BATCH_WORKERS", "4")),
+                        help="concurrent model calls")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="processes for parsing (default: one per cpu, 0 parses inline)")
+    args = parser.parse_args()
+
+    # imported here so --help works without credentials
+    import app as flex
+
+    if args.input == "-":
+        submissions = read_jsonl(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            submissions = read_jsonl(f)
+
+    checkpoint_path = args.checkpoint or args.output
+    completed = load_completed_ids(checkpoint_path)
+    if completed:
+        print(f"Resuming: skipping {len(completed)} submissions already completed in {checkpoint_path}", file=sys.stderr)
+
+    out = open_for_append(args.output) if args.output else sys.stdout
+    checkpoint = open_for_append(checkpoint_path) if checkpoint_path and checkpoint_path != args.output else None
+
+    def on_result(result):
+        line = json.dumps(result) + "\n"
+        out.write(line)
+        out.flush()
+        if checkpoint and is_complete(result):
+            checkpoint.write(line)
+            checkpoint.flush()
+
+    try:
+        # progress prints (ours and the app's) go to stderr so they can't interleave with results on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            run_batch(
+                submissions,
+                prepare=flex.prepare_submission,
+                request_graph=flex.analyze_graph,
+                request_explanation=lambda code, intent, prepared: flex.analyze_explanation(code, intent, prepared, raise_errors=True),
+                on_result=on_result,
+                workers=args.workers,
+                processes=args.processes,
+                skip_ids=completed,
+            )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if checkpoint:
+            checkpoint.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Micro-benchmark: single-pass recover_json vs the original robust_json_parse.
+
+Run from the backend directory:
+    python benchmarks/bench_json_recovery.py [--repeat N] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_recovery import recover_json  # noqa: E402
+from malformed_outputs import build_corpus  # noqa: E402
+
+
+def legacy_robust_json_parse(response_text):
+    # the original four-phase parser, kept verbatim (minus prints) as the baseline
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        pass
+
+    pattern = r"```(?:json)?\s*(\{[\s\S]*?\})\s*```|(\{[\s\S]*\})"
+    match = re.search(pattern, response_text)
+    if match:
+        json_candidate = match.group(1) or match.group(2)
+        json_candidate = json_candidate.strip('`')
+        try:
+            return json.loads(json_candidate)
+        except json.JSONDecodeError:
+            pass
+
+    start_index = response_text.find('{')
+    end_index = response_text.rfind('}') + 1
+    if start_index != -1 and end_index != -1 and end_index > start_index:
+        json_text = response_text[start_index:end_index]
+        try:
+            return json.loads(json_text)
+        except json.JSONDecodeError:
+            lines = json_text.split('\n')
+            while lines:
+                candidate = '\n'.join(lines)
+                try:
+                    return json.loads(candidate)
+                except json.JSONDecodeError:
+                    lines.pop()
+            return None
+    return None
+
+
+def legacy_explanation_parse(response_text):
+    # the original explanation path: newline-escaping regex over the whole response, then the parser
+    def escape_newlines_in_quoted_strings(m):
+        return m.group(0).replace("\n", "\\n")
+
+    quoted_string_pattern = r'"([^"\\]*(\\.[^"\\]*)*)"'
+    return legacy_robust_json_parse(re.sub(quoted_string_pattern, escape_newlines_in_quoted_strings, response_text))
+
+
+def summarize(value):
+    # how much survived parsing: node count for graphs, characters of text for explanations
+    if not isinstance(value, dict):
+        return "-"
+    if "nodes" in value:
+        return f"{len(value.get('nodes', []))} nodes"
+    if "explanation" in value:
+        return f"{len(value['explanation'])} chars"
+    return "{}"
+
+
+def time_call(fn, text, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="timing repetitions per case (best is reported)")
+    parser.add_argument("--json", action="store_true", help="print results as json lines instead of a table")
+    args = parser.parse_args()
+
+    rows = []
+    for name, text in build_corpus():
+        legacy_fn = legacy_explanation_parse if name.startswith("explanation") else legacy_robust_json_parse
+        legacy_time, legacy_value = time_call(legacy_fn, text, args.repeat)
+        new_time, (new_value, phase) = time_call(recover_json, text, args.repeat)
+        rows.append({
+            "case": name,
+            "bytes": len(text),
+            "legacy_us": round(legacy_time * 1e6, 1),
+            "legacy_result": summarize(legacy_value),
+            "recover_us": round(new_time * 1e6, 1),
+            "recover_result": summarize(new_value),
+            "recover_phase": phase,
+        })
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+        return
+
+    header = f"{'case':<34}{'bytes':>8}{'legacy us':>12}{'legacy got':>14}{'recover us':>12}{'recover got':>14}  phase"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['case']:<34}{row['bytes']:>8}{row['legacy_us']:>12}{row['legacy_result']:>14}"
+            f"{row['recover_us']:>12}{row['recover_result']:>14}  {row['recover_phase']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""Load test: concurrent /api/analyze_code requests against a local backend and mock model server.
+
+Run from the backend directory (no API key or network needed):
+    python benchmarks/load_test.py [--sizes 10,50,200,1000] [--requests N] [--concurrency N] [--output results.json]
+    python benchmarks/load_test.py --compare baseline.json [--max-regression 0.1]
+
+Each code size gets a fresh backend process, pointed at benchmarks/mock_openai.py through OPENAI_BASE_URL, so
+caches start empty and peak memory is per case. Submissions are unique unless --duplicates is set, which
+resubmits earlier code for that fraction of requests to exercise the caches and request coalescing.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+INTENT = "Keep a max-heap of scores and report the largest ones, skipping invalid entries."
+
+# small functions in the style of what users submit; each is 9 lines followed by a blank one.
+# {n} keeps names unique within a submission and {seed} makes every submission's code distinct
+FUNCTION_TEMPLATES = (
+    """def push_{n}(heap, value):
+    heap.append(value + {seed})
+    index = len(heap) - 1
+    while index > 0:
+        parent = (index - 1) // 2
+        if heap[index] > heap[parent]:
+            heap[index], heap[parent] = heap[parent], heap[index]
+        index = parent
+    return heap""",
+    """def search_{n}(items, target):
+    low, high = 0, len(items) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        if items[middle] == target + {seed}:
+            return middle
+        if items[middle] < target:
+            low = middle + 1
+        high = middle - 1""",
+    """def count_words_{n}(text):
+    counts = {{}}
+    for word in text.lower().split():
+        word = word.strip(".,!?")
+        if len(word) < {seed} % 3:
+            continue
+        counts[word] = counts.get(word, 0) + 1
+    ranked = sorted(counts.items(), key=lambda item: item[1])
+    return ranked[:10]""",
+    """def clean_scores_{n}(rows):
+    scores = []
+    for row in rows:
+        try:
+            value = float(row.get("score", {seed}))
+        except (TypeError, ValueError):
+            continue
+        scores.append(value)
+    return scores""",
+    """class Tracker_{n}:
+    def __init__(self):
+        self.best = None
+        self.seen = {seed}
+
+    def add(self, value):
+        self.seen += 1
+        if self.best is None or value < self.best:
+            self.best = value""",
+)
+
+
+def build_code(line_count, seed):
+    # roughly line_count lines of valid python, topped up with module-level statements
+    blocks = []
+    used = 0
+    n = 0
+    while used + 10 <= line_count:
+        blocks.append(FUNCTION_TEMPLATES[n % len(FUNCTION_TEMPLATES)].format(n=n, seed=seed))
+        used += 10
+        n += 1
+    if used < line_count or not blocks:
+        blocks.append("\n".join(f"LIMIT_{i} = {seed + i}" for i in range(max(1, line_count - used))))
+    return "\n\n".join(blocks)
+
+
+def percentile(values, fraction):
+    # linear interpolation between the closest ranks
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process exited with code {process.returncode} before listening on port {port}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port} after {timeout}s")
+
+
+def serve_backend(port, rss_path):
+    # runs in the backend subprocess: the flask app on a threaded werkzeug server, like `flask run`, writing its
+    # peak memory to rss_path when stopped
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+
+    server = make_server("127.0.0.1", port, backend.app, threaded=True)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # ru_maxrss is in kilobytes on linux and bytes on macos
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with open(rss_path, "w") as f:
+            json.dump({"max_rss_kb": max_rss // 1024 if sys.platform == "darwin" else max_rss}, f)
+
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def post(url, payload, timeout):
+    # returns (status, seconds, parsed body or None); the body is read to the end so streamed responses count in full
+    data = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    started_at = time.monotonic()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        status = e.code
+    except (urllib.error.URLError, OSError) as e:
+        return f"error: {e}", time.monotonic() - started_at, None
+    seconds = time.monotonic() - started_at
+    try:
+        return status, seconds, json.loads(body)
+    except ValueError:
+        return status, seconds, None
+
+
+def scrape_stage_seconds(base_url):
+    # average milliseconds per in-process stage, from the backend's /metrics
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=5) as response:
+            text = response.read().decode("utf-8")
+    except (urllib.error.URLError, OSError):
+        return {}
+    sums = dict(re.findall(r'^flex_stage_seconds_sum\{stage="([^"]+)"\} (\S+)$', text, re.M))
+    counts = dict(re.findall(r'^flex_stage_seconds_count\{stage="([^"]+)"\} (\S+)$', text, re.M))
+    return {
+        name: round(float(total) / float(counts[name]) * 1000, 3)
+        for name, total in sums.items() if float(counts.get(name, 0))
+    }
+
+
+def run_case(args, line_count, mock_url, workdir):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    rss_path = os.path.join(workdir, f"rss-{line_count}.json")
+    log_path = os.path.join(workdir, f"backend-{line_count}.log")
+
+    env = dict(os.environ, OPENAI_BASE_URL=mock_url, OPENAI_API_KEY="mock", FLEX_CACHE_DB="", FLEX_TRACE_SAMPLE_RATE="0")
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    with open(log_path, "w") as log:
+        backend = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve-backend", str(port), "--rss-file", rss_path],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    try:
+        try:
+            wait_for_port(port, backend)
+        except RuntimeError as e:
+            with open(log_path) as f:
+                raise RuntimeError(f"backend failed to start: {e}\n{f.read()[-2000:]}") from None
+
+        # which submission each request sends: a new one, or with probability --duplicates an earlier one
+        rng = random.Random(args.seed + line_count)
+        seeds = []
+        for i in range(args.requests):
+            seeds.append(rng.choice(seeds) if seeds and rng.random() < args.duplicates else line_count * 100000 + i)
+        path = "/api/analyze_code/stream" if args.endpoint == "stream" else "/api/analyze_code"
+
+        def send(seed):
+            return post(base_url + path, {"code": build_code(line_count, seed), "intent": INTENT}, args.timeout)
+
+        started_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(send, seeds))
+        wall_seconds = time.monotonic() - started_at
+        stages = scrape_stage_seconds(base_url)
+    finally:
+        stop(backend)
+
+    max_rss_kb = None
+    if os.path.exists(rss_path):
+        with open(rss_path) as f:
+            max_rss_kb = json.load(f)["max_rss_kb"]
+
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [seconds for status, seconds, body in results if status == 200]
+    # a 200 without a graph still means the model's response couldn't be used
+    graph_errors = sum(
+        1 for status, _, body in results
+        if status == 200 and isinstance(body, dict) and (body.get("graph_error") or not body.get("nodes"))
+    ) if args.endpoint == "analyze" else None
+
+    return {
+        "lines": line_count,
+        "requests": len(results),
+        "statuses": statuses,
+        "graph_errors": graph_errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        "p50_seconds": round(percentile(ok, 0.50), 4) if ok else None,
+        "p95_seconds": round(percentile(ok, 0.95), 4) if ok else None,
+        "p99_seconds": round(percentile(ok, 0.99), 4) if ok else None,
+        "max_rss_mb": round(max_rss_kb / 1024, 1) if max_rss_kb else None,
+        "stage_ms": stages,
+    }
+
+
+# metric -> True when higher is better, for --compare
+COMPARED_METRICS = {"throughput_rps": True, "p95_seconds": False, "max_rss_mb": False}
+
+
+def compare(cases, baseline_cases, max_regression):
+    # returns one message per metric that got worse than the baseline by more than max_regression (a fraction)
+    baseline_by_lines = {case["lines"]: case for case in baseline_cases}
+    regressions = []
+    for case in cases:
+        baseline = baseline_by_lines.get(case["lines"])
+        if baseline is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = case.get(metric), baseline.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (-change if higher_is_better else change) > max_regression:
+                regressions.append(f"{case['lines']} lines: {metric} {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,50,200,1000", help="comma-separated code sizes in lines")
+    parser.add_argument("--requests", type=int, default=40, help="requests per size")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--endpoint", choices=("analyze", "stream"), default="analyze")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="fraction of requests resubmitting earlier code")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a request counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra backend environment, e.g. --env FLEX_AST_CONTEXT=full (repeatable)")
+    # passed through to mock_openai.py
+    parser.add_argument("--latency", type=float, default=0.5, help="mock model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="mock model latency jitter in seconds")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="mock seconds between streamed chunks")
+    parser.add_argument("--scenario", choices=("valid", "malformed", "mixed"), default="mixed")
+    parser.add_argument("--responses", help="recorded responses for the mock to replay (see mock_openai.py)")
+    # results
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--compare", help="results json from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="with --compare, exit 1 if throughput, p95 or memory is this fraction worse")
+    parser.add_argument("--json", action="store_true", help="print the results as json instead of a table")
+    # internal: run as the backend subprocess
+    parser.add_argument("--serve-backend", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--rss-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_backend:
+        serve_backend(args.serve_backend, args.rss_file)
+        return
+
+    mock_port = free_port()
+    mock_command = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, "mock_openai.py"), "--port", str(mock_port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter), "--chunk-delay", str(args.chunk_delay),
+        "--scenario", args.scenario, "--seed", str(args.seed),
+    ]
+    if args.responses:
+        mock_command += ["--responses", args.responses]
+    mock = subprocess.Popen(mock_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    cases = []
+    try:
+        wait_for_port(mock_port, mock)
+        with tempfile.TemporaryDirectory() as workdir:
+            for line_count in [int(size) for size in args.sizes.split(",")]:
+                cases.append(run_case(args, line_count, f"http://127.0.0.1:{mock_port}/v1", workdir))
+    finally:
+        stop(mock)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "json", "serve_backend", "rss_file")}
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": config,
+        },
+        "cases": cases,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'lines':>6} {'ok':>5} {'other':>6} {'graph err':>9} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'rss MB':>7}")
+        for case in cases:
+            ok = case["statuses"].get("200", 0)
+            fmt = lambda value: f"{value:.3f}" if isinstance(value, float) else "-"
+            print(
+                f"{case['lines']:>6} {ok:>5} {case['requests'] - ok:>6} "
+                f"{case['graph_errors'] if case['graph_errors'] is not None else '-':>9} {fmt(case['throughput_rps']):>7} "
+                f"{fmt(case['p50_seconds']):>7} {fmt(case['p95_seconds']):>7} {fmt(case['p99_seconds']):>7} "
+                f"{case['max_rss_mb'] if case['max_rss_mb'] else '-':>7}"
+            )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(cases, json.load(f)["cases"], args.max_regression)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.max_regression:.0%} against {args.compare}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
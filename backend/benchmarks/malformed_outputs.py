@@ -0,0 +1,61 @@
+import json
+
+# synthetic corpus of model responses in the shapes we actually see from the graph and explanation prompts:
+# clean json, fenced json, chatter around the json, raw newlines inside strings, trailing commas,
+# and completions cut off by max_tokens at different points
+
+
+def make_graph(node_count):
+    nodes = []
+    edges = []
+    for i in range(node_count):
+        node = {"id": f"n{i}", "label": f"Step {i}: compare heap[index] with heap[parent]"}
+        if i % 7 == 3:
+            node["error"] = {
+                "line": "if heap[index] > heap[parent]:",
+                "message": "When a smaller element is pushed, it stays below its parent instead of moving up.",
+            }
+        nodes.append(node)
+        if i:
+            edges.append({"id": f"e{i - 1}-{i}", "source": f"n{i - 1}", "target": f"n{i}"})
+    return {"nodes": nodes, "edges": edges}
+
+
+def make_explanation(paragraphs):
+    lines = [
+        f"- `line {i}`: when the loop reaches index {i}, the element is compared with its parent\n"
+        "  and swapped only when it is bigger, so the largest element ends up on top."
+        for i in range(paragraphs)
+    ]
+    return {"explanation": "\n".join(lines)}
+
+
+def with_raw_newlines(value):
+    # models frequently emit real newlines inside json strings instead of \n
+    return json.dumps(value, indent=2).replace("\\n", "\n")
+
+
+def build_corpus():
+    # returns a list of (name, response_text) pairs
+    corpus = []
+    for size in (8, 40, 200):
+        graph = make_graph(size)
+        text = json.dumps(graph, indent=2)
+        corpus.append((f"graph{size}-valid", text))
+        corpus.append((f"graph{size}-fenced", f"```json\n{text}\n```"))
+        corpus.append((f"graph{size}-chatter", f"Here is the conceptual graph:\n{text}\nLet me know if you need more."))
+        corpus.append((f"graph{size}-trailing-comma", text.replace("}\n  ]", "},\n  ]")))
+        # cutting the completion off at several depths, the usual max_tokens failure
+        for fraction in (0.35, 0.6, 0.9):
+            corpus.append((f"graph{size}-truncated-{int(fraction * 100)}", text[: int(len(text) * fraction)]))
+        corpus.append((f"graph{size}-fenced-truncated", f"```json\n{text[: int(len(text) * 0.75)]}"))
+
+    for paragraphs in (3, 30):
+        explanation = make_explanation(paragraphs)
+        raw = with_raw_newlines(explanation)
+        corpus.append((f"explanation{paragraphs}-raw-newlines", raw))
+        corpus.append((f"explanation{paragraphs}-fenced-raw-newlines", f"```json\n{raw}\n```"))
+        corpus.append((f"explanation{paragraphs}-truncated", raw[: int(len(raw) * 0.6)]))
+
+    corpus.append(("no-json", "I could not produce a graph for this code."))
+    return corpus
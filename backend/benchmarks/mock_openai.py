@@ -0,0 +1,243 @@
+"""Local stand-in for the OpenAI chat completions API, for load tests that shouldn't pay for model calls.
+
+Run from the backend directory, then point the backend at it through the client's base url:
+    python benchmarks/mock_openai.py --port 8099 --latency 0.8 --scenario mixed
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=mock python app.py
+
+Responses are synthetic by default (see malformed_outputs.py). The graph and explanation responses come
+clean, malformed (fenced, chatty, trailing commas, raw newlines) or truncated, depending on --scenario.
+--responses replays recorded ones instead, either {"kind", "text"} lines or the backend's own trace log
+(FLEX_TRACE_LOG), whose "response" events hold every raw model response.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from malformed_outputs import make_explanation, make_graph, with_raw_newlines
+
+# request kinds, named like the kind label the backend uses in /metrics and the trace log
+KINDS = ("graph", "graph-skeleton", "units", "explanation", "node")
+
+# what a malformed-scenario response can look like, in the order they're cycled through
+GRAPH_VARIANTS = ("fenced", "chatter", "trailing-comma", "truncated-90", "fenced-truncated", "truncated-60")
+EXPLANATION_VARIANTS = ("raw-newlines", "fenced-raw-newlines", "truncated")
+
+
+def classify(messages):
+    # tells the backend's prompts apart by their fixed instructions
+    system = messages[0].get("content", "") if messages else ""
+    user = messages[-1].get("content", "") if messages else ""
+    if system.startswith("You produce a dynamic conceptual graph"):
+        if "Changed units:" in user:
+            return "units"
+        if "Do not write the error explanations themselves" in user:
+            return "graph-skeleton"
+        return "graph"
+    if system.startswith("You explain one step"):
+        return "node"
+    return "explanation"
+
+
+def graph_for(user_prompt, skeleton):
+    # node count grows with the submission, roughly like the real model's graphs
+    function_count = len(re.findall(r"\bdef \w+", user_prompt))
+    graph = make_graph(min(60, 3 + 2 * function_count))
+    for index, node in enumerate(graph["nodes"]):
+        node["lines"] = f"{index + 1}-{index + 3}"
+        if skeleton and "error" in node:
+            node["error"] = True
+    return graph
+
+
+def units_for(user_prompt):
+    names = re.findall(r"Unit '([^']+)'", user_prompt)
+    nodes = []
+    edges = []
+    for name in names:
+        # ids are unique across units, as the units prompt asks for
+        nodes.append({"id": f"{name}_entry", "unit": name, "label": f"Enter {name}"})
+        nodes.append({"id": f"{name}_body", "unit": name, "label": f"Run the body of {name}"})
+        edges.append({"source": f"{name}_entry", "target": f"{name}_body"})
+    return {"nodes": nodes, "edges": edges, "explanations": {name: f"- `{name}` follows the intent." for name in names}}
+
+
+def apply_variant(text, variant):
+    if variant == "fenced":
+        return f"```json\n{text}\n```"
+    if variant == "chatter":
+        return f"Here is the conceptual graph:\n{text}\nLet me know if you need more."
+    if variant == "trailing-comma":
+        return text.replace("}\n  ]", "},\n  ]")
+    if variant == "fenced-truncated":
+        return f"```json\n{text[: int(len(text) * 0.75)]}"
+    if variant.startswith("truncated"):
+        fraction = int(variant.rsplit("-", 1)[-1]) / 100 if "-" in variant else 0.6
+        return text[: int(len(text) * fraction)]
+    if variant == "raw-newlines":
+        return with_raw_newlines(json.loads(text))
+    if variant == "fenced-raw-newlines":
+        return f"```json\n{with_raw_newlines(json.loads(text))}\n```"
+    return text
+
+
+class ResponseSource:
+    # picks the response text for each request. scenario is "valid", "malformed" or "mixed" (every other
+    # response malformed); recorded is {kind: [texts]} and takes priority for the kinds it covers
+
+    def __init__(self, scenario="mixed", recorded=None):
+        self.scenario = scenario
+        self.recorded = {kind: itertools.cycle(texts) for kind, texts in (recorded or {}).items() if texts}
+        self._counters = {kind: itertools.count() for kind in KINDS}
+        self._lock = threading.Lock()
+
+    def respond(self, kind, messages):
+        with self._lock:
+            if kind in self.recorded:
+                return next(self.recorded[kind])
+            turn = next(self._counters[kind])
+
+        user = messages[-1].get("content", "") if messages else ""
+        if kind == "node":
+            return "When the loop reaches the last element, it compares it with itself instead of its parent."
+        if kind == "units":
+            value = units_for(user)
+            variants = GRAPH_VARIANTS
+        elif kind == "explanation":
+            value = make_explanation(3 + len(re.findall(r"\bdef \w+", user)) % 20)
+            variants = EXPLANATION_VARIANTS
+        else:
+            value = graph_for(user, skeleton=kind == "graph-skeleton")
+            variants = GRAPH_VARIANTS
+
+        text = json.dumps(value, indent=2)
+        if self.scenario == "valid" or (self.scenario == "mixed" and turn % 2 == 0):
+            return text
+        index = turn // 2 if self.scenario == "mixed" else turn
+        return apply_variant(text, variants[index % len(variants)])
+
+
+def load_recorded(path):
+    # {"kind", "text"} lines, or trace log lines whose "response" events carry kind and text
+    recorded = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            events = record.get("events") if isinstance(record, dict) else None
+            items = [e for e in events if e.get("event") == "response"] if events else [record]
+            for item in items:
+                if isinstance(item, dict) and item.get("kind") in KINDS and isinstance(item.get("text"), str):
+                    recorded.setdefault(item["kind"], []).append(item["text"])
+    return recorded
+
+
+def make_handler(source, latency, jitter, chunk_delay, chunk_chars):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = body.get("messages", [])
+            kind = classify(messages)
+            text = source.respond(kind, messages)
+            prompt_chars = sum(len(m.get("content", "")) for m in messages)
+            usage = {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": prompt_chars // 4 + len(text) // 4,
+            }
+
+            # latency is the time to the first token; streams then add chunk_delay per chunk
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+            if body.get("stream"):
+                self._stream(body, text, usage)
+            else:
+                self._send_json({
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+        def _send_json(self, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, body, text, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            # no content length, so the connection closes when the stream ends
+            self.send_header("Connection", "close")
+            self.end_headers()
+            base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model", "mock")}
+
+            def send(payload):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for start in range(0, len(text), chunk_chars):
+                send(dict(base, choices=[{"index": 0, "delta": {"content": text[start:start + chunk_chars]}, "finish_reason": None}]))
+                time.sleep(chunk_delay)
+            send(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send(dict(base, choices=[], usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            # one line per request would dominate a load test's output
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the response (or first chunk)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="uniform +/- seconds added to --latency")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="seconds between streamed chunks")
+    parser.add_argument("--chunk-chars", type=int, default=24, help="characters per streamed chunk")
+    parser.add_argument("--scenario", choices=("valid", "malformed", "mixed"), default="mixed")
+    parser.add_argument("--responses", help="jsonl of recorded responses ({kind, text} lines or a FLEX_TRACE_LOG file)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the latency jitter")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    source = ResponseSource(args.scenario, load_recorded(args.responses) if args.responses else None)
+    handler = make_handler(source, args.latency, args.jitter, args.chunk_delay, args.chunk_chars)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Mock chat completions API on http://{args.host}:{server.server_address[1]}/v1", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+
+import numpy as np
+
+# matches the node box the frontend draws
+NODE_WIDTH = 172
+NODE_HEIGHT = 36
+# space between neighbouring nodes in a layer, and between layers
+NODE_GAP = 48
+LAYER_GAP = 64
+
+# crossing minimization rounds (one downward and one upward barycenter sweep each)
+ORDERING_ROUNDS = 8
+# rounds pulling nodes toward their neighbours during coordinate assignment
+STRAIGHTENING_ROUNDS = 4
+
+
+def graph_shape(node_ids, edges):
+    # reduces a graph to its shape: the node count plus edges as sorted (source index, target index) pairs.
+    # edges to unknown ids, self loops and duplicates are dropped, so two graphs that only differ in ids
+    # and labels have the same shape
+    index_of = {node_id: index for index, node_id in enumerate(node_ids)}
+    pairs = set()
+    for edge in edges:
+        source = index_of.get(edge.get("source"))
+        target = index_of.get(edge.get("target"))
+        if source is not None and target is not None and source != target:
+            pairs.add((source, target))
+    return len(node_ids), sorted(pairs)
+
+
+def shape_key(node_count, pairs):
+    raw = json.dumps([node_count, pairs], separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def layout_shape(node_count, pairs, seed_positions=None):
+    # layered (sugiyama-style) layout, top to bottom along the edges
+    # (ref: https://en.wikipedia.org/wiki/Layered_graph_drawing):
+    #  1. cycle breaking: edges that close a cycle in a depth-first search are reversed
+    #  2. layer assignment: longest path from the sources, so every edge points down
+    #  3. crossing minimization: edges spanning several layers get dummy nodes, then each layer is reordered by
+    #     the barycenter of its neighbours, keeping the ordering with the fewest crossings
+    #  4. coordinate assignment: nodes are pulled toward their neighbours (across long edges too) while staying
+    #     NODE_GAP apart
+    # seed_positions is a list aligned with the nodes of (x, y) from a previous layout, or None for new nodes.
+    # seeded nodes keep their previous left-to-right order and are pulled back to their previous x, with new
+    # nodes fitted in between, so a graph that grows by a few nodes doesn't jump around.
+    # returns a list of (x, y) top-left corners, one per node
+    if node_count == 0:
+        return []
+
+    dag_pairs = _break_cycles(node_count, pairs)
+    layers = _assign_layers(node_count, dag_pairs)
+    layers, sources, targets = _add_dummy_nodes(layers, dag_pairs)
+
+    # previous x per node, nan for new nodes and dummies
+    seed_xs = np.full(len(layers), np.nan)
+    if seed_positions:
+        for index, seed in enumerate(seed_positions):
+            if seed is not None:
+                seed_xs[index] = seed[0]
+
+    order = _initial_order(layers, seed_xs)
+    order = _minimize_crossings(layers, sources, targets, order, ~np.isnan(seed_xs))
+
+    # dummy nodes only guide the ordering: react flow draws edges directly, so they don't need space of their own
+    layers, order, seed_xs = layers[:node_count], order[:node_count], seed_xs[:node_count]
+    dag_sources, dag_targets = np.array(dag_pairs, dtype=np.int64).reshape(-1, 2).T
+    xs = _assign_x(layers, dag_sources, dag_targets, order, seed_xs)
+    ys = layers * float(NODE_HEIGHT + LAYER_GAP)
+
+    if np.isnan(seed_xs).all():
+        xs = xs - xs.min()
+    return [(round(float(x), 1), round(float(y), 1)) for x, y in zip(xs, ys)]
+
+
+def _break_cycles(node_count, pairs):
+    # iterative dfs, started from the nodes without incoming edges so the model's intended flow is kept
+    successors = [[] for _ in range(node_count)]
+    has_incoming = [False] * node_count
+    for source, target in pairs:
+        successors[source].append(target)
+        has_incoming[target] = True
+    roots = [i for i in range(node_count) if not has_incoming[i]] + [i for i in range(node_count) if has_incoming[i]]
+
+    state = [0] * node_count  # 0 unvisited, 1 on the dfs stack, 2 finished
+    back_edges = set()
+    for root in roots:
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node, remaining = stack[-1]
+            for successor in remaining:
+                if state[successor] == 1:
+                    back_edges.add((node, successor))
+                elif state[successor] == 0:
+                    state[successor] = 1
+                    stack.append((successor, iter(successors[successor])))
+                    break
+            else:
+                state[node] = 2
+                stack.pop()
+
+    # reversing can turn an edge into a duplicate of one going the other way already
+    return sorted({(t, s) if (s, t) in back_edges else (s, t) for s, t in pairs})
+
+
+def _assign_layers(node_count, dag_pairs):
+    layers = np.zeros(node_count, dtype=np.int64)
+    if not dag_pairs:
+        return layers
+    sources, targets = np.array(dag_pairs, dtype=np.int64).T
+
+    # longest path as a vectorized bellman-ford relaxation; a dag settles in at most node_count rounds
+    for _ in range(node_count):
+        relaxed = layers.copy()
+        np.maximum.at(relaxed, targets, layers[sources] + 1)
+        if np.array_equal(relaxed, layers):
+            break
+        layers = relaxed
+
+    # moving each source down to just above its highest successor, instead of leaving it stranded at the top
+    # with long edges into the middle of the graph
+    is_source = np.ones(node_count, dtype=bool)
+    is_source[targets] = False
+    highest_successor = np.full(node_count, np.iinfo(np.int64).max)
+    np.minimum.at(highest_successor, sources, layers[targets])
+    movable = is_source & (highest_successor != np.iinfo(np.int64).max)
+    layers[movable] = highest_successor[movable] - 1
+    return layers
+
+
+def _add_dummy_nodes(layers, dag_pairs):
+    # splits edges spanning several layers into one segment per layer, through dummy nodes numbered after the
+    # real ones, so crossing minimization sees where long edges actually pass
+    layer_list = list(layers)
+    sources = []
+    targets = []
+    for source, target in dag_pairs:
+        previous = source
+        for layer in range(layers[source] + 1, layers[target]):
+            layer_list.append(layer)
+            dummy = len(layer_list) - 1
+            sources.append(previous)
+            targets.append(dummy)
+            previous = dummy
+        sources.append(previous)
+        targets.append(target)
+    return np.array(layer_list, dtype=np.int64), np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+
+
+def _initial_order(layers, seed_xs):
+    # order is each node's index within its layer. nodes start in their original order (the model lists them
+    # roughly in reading order); seeded nodes then swap among their own slots to match their previous x
+    order = np.zeros(len(layers), dtype=float)
+    for layer in np.unique(layers):
+        members = np.flatnonzero(layers == layer)
+        order[members] = np.arange(len(members))
+        seeded = members[~np.isnan(seed_xs[members])]
+        order[seeded[np.argsort(seed_xs[seeded], kind="stable")]] = order[seeded]
+    return order
+
+
+def _minimize_crossings(layers, sources, targets, order, pinned):
+    # pinned nodes keep their order relative to each other; everything else moves around them
+    layer_count = int(layers.max()) + 1
+    members = [np.flatnonzero(layers == layer) for layer in range(layer_count)]
+    best_order = order.copy()
+    best_crossings = _count_crossings(layers, sources, targets, order)
+
+    for _ in range(ORDERING_ROUNDS):
+        if best_crossings == 0:
+            break
+        for layer in range(1, layer_count):
+            _reorder_layer(members[layer], sources, targets, order, pinned)
+        for layer in range(layer_count - 2, -1, -1):
+            _reorder_layer(members[layer], targets, sources, order, pinned)
+        crossings = _count_crossings(layers, sources, targets, order)
+        if crossings < best_crossings:
+            best_order = order.copy()
+            best_crossings = crossings
+    return best_order
+
+
+def _reorder_layer(layer_members, neighbours, nodes, order, pinned):
+    # sorts one layer by the mean order of each node's neighbours in the adjacent layer (nodes[i] is adjacent to
+    # neighbours[i]). pinned nodes and nodes without neighbours keep their current place, and ties keep the
+    # current order
+    size = len(order)
+    totals = np.bincount(nodes, weights=order[neighbours], minlength=size)[layer_members]
+    counts = np.bincount(nodes, minlength=size)[layer_members]
+    current = order[layer_members]
+    movable = (counts > 0) & ~pinned[layer_members]
+    barycenters = np.where(movable, totals / np.maximum(counts, 1), current)
+    ranked = np.lexsort((current, barycenters))
+    order[layer_members[ranked]] = np.arange(len(layer_members))
+
+
+def _count_crossings(layers, sources, targets, order):
+    # two segments between the same pair of layers cross when their ends are in opposite orders
+    crossings = 0
+    segment_layers = layers[sources]
+    for layer in np.unique(segment_layers):
+        selected = segment_layers == layer
+        top = order[sources[selected]]
+        bottom = order[targets[selected]]
+        crossings += int(np.sum((top[:, None] < top[None, :]) & (bottom[:, None] > bottom[None, :])))
+    return crossings
+
+
+def _assign_x(layers, sources, targets, order, seed_xs):
+    step = float(NODE_WIDTH + NODE_GAP)
+    xs = np.where(np.isnan(seed_xs), order * step, seed_xs)
+    layer_count = int(layers.max()) + 1
+    members = [np.flatnonzero(layers == layer) for layer in range(layer_count)]
+    members = [m[np.argsort(order[m])] for m in members]
+
+    for _ in range(STRAIGHTENING_ROUNDS):
+        for layer in range(1, layer_count):
+            _straighten_layer(members[layer], sources, targets, xs, seed_xs, step)
+        for layer in range(layer_count - 2, -1, -1):
+            _straighten_layer(members[layer], targets, sources, xs, seed_xs, step)
+    if layer_count == 1:
+        # no edges, so both sweeps above are empty; the single layer still needs its spacing restored, since
+        # seeded and unseeded nodes can start on top of each other
+        _straighten_layer(members[0], targets, sources, xs, seed_xs, step)
+    return xs
+
+
+def _straighten_layer(layer_members, neighbours, nodes, xs, seed_xs, step):
+    # moves each node of a layer (in left-to-right order) to the mean x of its neighbours, or back to its previous
+    # x if it has one, then restores the minimum spacing. pushing overlaps right and pushing them left give two
+    # valid placements; their average is also valid and doesn't drift to either side
+    size = len(xs)
+    totals = np.bincount(nodes, weights=xs[neighbours], minlength=size)[layer_members]
+    counts = np.bincount(nodes, minlength=size)[layer_members]
+    wanted = np.where(counts > 0, totals / np.maximum(counts, 1), xs[layer_members])
+    seeded = seed_xs[layer_members]
+    wanted = np.where(np.isnan(seeded), wanted, seeded)
+
+    offsets = np.arange(len(layer_members)) * step
+    shifted = wanted - offsets
+    pushed_right = np.maximum.accumulate(shifted) + offsets
+    pushed_left = np.minimum.accumulate(shifted[::-1])[::-1] + offsets
+    xs[layer_members] = (pushed_right + pushed_left) / 2
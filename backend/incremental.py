@@ -0,0 +1,153 @@
+import ast
+
+from response_cache import fingerprint_code, statement_lines
+
+# name of the unit holding every top-level statement that isn't a function or class
+MODULE_UNIT = "__module__"
+
+# separates the unit name from the model's own node id, e.g. "push_heap::swap_parent"
+ID_SEPARATOR = "::"
+
+MAX_CALL_SITES = 20
+
+
+def split_units(code, tree):
+    # splits a submission into the units re-analysis works with: one per top-level function/class, plus one for
+    # the remaining module-level statements. returns them in source order as dicts with
+    # name, fingerprint (normalized, see response_cache.fingerprint_code), statements, statement_lines and
+    # numbered source
+    lines = code.splitlines()
+    units = []
+    module_statements = []
+    seen_names = {}
+    for stmt in tree.body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            # a redefinition of the same name gets its own unit rather than replacing the first one
+            seen_names[stmt.name] = seen_names.get(stmt.name, 0) + 1
+            name = stmt.name if seen_names[stmt.name] == 1 else f"{stmt.name}#{seen_names[stmt.name]}"
+            units.append({"name": name, "statements": [stmt]})
+        else:
+            module_statements.append(stmt)
+    if module_statements:
+        units.append({"name": MODULE_UNIT, "statements": module_statements})
+
+    for unit in units:
+        unit_tree = ast.Module(body=unit["statements"], type_ignores=[])
+        unit["fingerprint"] = fingerprint_code(unit_tree)
+        unit["statement_lines"] = statement_lines(unit_tree)
+        unit["source"] = "\n".join(_numbered_lines(lines, stmt) for stmt in unit["statements"])
+    return units
+
+
+def _numbered_lines(lines, stmt):
+    # source of one statement with its original line numbers, so the model can still reference lines
+    decorators = getattr(stmt, "decorator_list", [])
+    start = min([stmt.lineno] + [d.lineno for d in decorators])
+    end = stmt.end_lineno or stmt.lineno
+    return "\n".join(f"{number:>4} | {lines[number - 1]}" for number in range(start, end + 1))
+
+
+def diff_units(units, previous_units):
+    # compares against the previous submission's units (name -> stored record with a fingerprint).
+    # returns (changed unit names, unchanged unit names), both in source order
+    changed = []
+    unchanged = []
+    for unit in units:
+        previous = previous_units.get(unit["name"])
+        if previous is not None and previous.get("fingerprint") == unit["fingerprint"]:
+            unchanged.append(unit["name"])
+        else:
+            changed.append(unit["name"])
+    return changed, unchanged
+
+
+def find_call_sites(code, units, changed_names):
+    # lines in unchanged units that call a changed function, given to the model as context for how it's used
+    lines = code.splitlines()
+    called_names = {name for name in changed_names if name != MODULE_UNIT}
+    sites = []
+    for unit in units:
+        if unit["name"] in changed_names:
+            continue
+        for stmt in unit["statements"]:
+            for sub in ast.walk(stmt):
+                if not isinstance(sub, ast.Call):
+                    continue
+                func = sub.func
+                func_name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+                if func_name in called_names:
+                    sites.append(f"{sub.lineno:>4} | {lines[sub.lineno - 1].strip()}")
+    # a call spanning nested expressions can be found twice on the same line
+    return list(dict.fromkeys(sites))[:MAX_CALL_SITES]
+
+
+def namespace_unit_graph(nodes, edges, unit_names, existing_node_ids):
+    # turns the model's nodes (each tagged with the "unit" it belongs to) into per-unit subgraphs with ids
+    # prefixed by their unit, so ids stay stable and can't collide with reused units' nodes.
+    # edges may point at existing_node_ids from reused units; edges to unknown or ambiguous ids are dropped.
+    # returns {unit name: {"nodes": [...], "edges": [...]}}
+    subgraphs = {name: {"nodes": [], "edges": []} for name in unit_names}
+    id_map = {}  # (unit, raw id) -> namespaced id
+    units_by_raw_id = {}  # raw id -> units that used it, since the model can reuse an id like "entry" per unit
+    unit_of = {}
+    for node in nodes:
+        unit = node.pop("unit", None)
+        if unit not in subgraphs:
+            # untagged or mis-tagged nodes go to the first changed unit rather than being lost
+            unit = unit_names[0]
+        raw_id = str(node.get("id", len(unit_of)))
+        node["id"] = f"{unit}{ID_SEPARATOR}{raw_id}"
+        id_map[(unit, raw_id)] = node["id"]
+        units_by_raw_id.setdefault(raw_id, []).append(unit)
+        unit_of[node["id"]] = unit
+        subgraphs[unit]["nodes"].append(node)
+
+    def resolve(raw_id, unit):
+        # an endpoint is looked up in the edge's own unit first, then among ids only one unit used,
+        # then among the reused units' (already namespaced) ids
+        if (unit, raw_id) in id_map:
+            return id_map[(unit, raw_id)]
+        owners = units_by_raw_id.get(raw_id, [])
+        if len(owners) == 1:
+            return id_map[(owners[0], raw_id)]
+        if not owners and (raw_id in unit_of or raw_id in existing_node_ids):
+            return raw_id
+        return None
+
+    for edge in edges:
+        raw_source = str(edge.get("source"))
+        raw_target = str(edge.get("target"))
+        # the edge's unit is the one tagged on it, or else the one unit both of its endpoints belong to
+        unit = edge.get("unit")
+        if unit not in subgraphs:
+            shared = set(units_by_raw_id.get(raw_source, [])) & set(units_by_raw_id.get(raw_target, []))
+            unit = shared.pop() if len(shared) == 1 else None
+        source = resolve(raw_source, unit)
+        target = resolve(raw_target, unit)
+        if source is None or target is None:
+            continue
+        # an edge belongs to the unit it starts in, or the one it ends in when it starts in a reused unit
+        owner = unit_of.get(source) or unit_of.get(target)
+        if owner is None:
+            continue
+        subgraphs[owner]["edges"].append({"id": f"e-{source}-{target}", "source": source, "target": target})
+    return subgraphs
+
+
+def merge_units(units, records):
+    # joins per-unit records (name -> {"nodes", "edges", "explanation"}) back into one graph in source order.
+    # edges whose endpoint belonged to a unit that has since changed or disappeared are dropped
+    nodes = []
+    edges = []
+    explanations = []
+    for unit in units:
+        record = records.get(unit["name"])
+        if record is None:
+            continue
+        nodes.extend(record["nodes"])
+        edges.extend(record["edges"])
+        if record.get("explanation"):
+            explanations.append(record["explanation"])
+    node_ids = {node["id"] for node in nodes}
+    edges = [edge for edge in edges if edge["source"] in node_ids and edge["target"] in node_ids]
+    return nodes, edges, "\n\n".join(explanations)
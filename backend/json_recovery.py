@@ -0,0 +1,157 @@
+import bisect
+import json
+
+# closing character for each opening bracket
+_CLOSERS = {"{": "}", "[": "]"}
+
+# raw control characters models leave inside strings, and their json escapes
+_STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+# strict=False lets the c decoder accept raw newlines inside strings, and raw_decode ignores
+# whatever follows the object (closing fences, chatter), so undamaged responses never reach the python scan
+_lenient_decoder = json.JSONDecoder(strict=False)
+
+
+def recover_json(text):
+    # tolerant parser for model output, linear in the size of the response.
+    # returns (value, phase) where phase says how the value was obtained:
+    #   "direct"    - the text was already valid json
+    #   "trimmed"   - valid once fences/chatter around it were skipped (raw newlines in strings allowed)
+    #   "repaired"  - complete, but needed fixes such as dropping trailing commas
+    #   "truncated" - the output was cut off (usually by max_tokens) and open strings/arrays/objects were closed
+    #   "prefix"    - something invalid appeared mid-way, so the longest valid prefix before it was kept
+    #   None        - nothing usable was found
+    try:
+        return json.loads(text), "direct"
+    except json.JSONDecodeError:
+        pass
+
+    start = text.find("{")
+    if start == -1:
+        return None, None
+
+    try:
+        return _lenient_decoder.raw_decode(text, start)[0], "trimmed"
+    except json.JSONDecodeError:
+        pass
+
+    out, safe_points, complete, tail = _scan(text, start)
+
+    if complete:
+        candidate = "".join(out)
+        phase = "repaired"
+    else:
+        candidate = tail
+        phase = "truncated"
+
+    try:
+        return json.loads(candidate), phase
+    except json.JSONDecodeError as e:
+        error_pos = e.pos
+        if phase == "truncated" and safe_points:
+            # the tail was built from the end of out; map the error to the last position we produced
+            error_pos = len(out)
+
+    # cutting back to the last point where a value had fully closed before the error, then closing what's open
+    positions = [pos for pos, _ in safe_points]
+    index = bisect.bisect_right(positions, error_pos) - 1
+    if index < 0:
+        return None, None
+    pos, closers = safe_points[index]
+    try:
+        return json.loads("".join(out[:pos]) + closers), "prefix"
+    except json.JSONDecodeError as e:
+        print(f"JSON recovery failed: {e}")
+        return None, None
+
+
+def _scan(text, start):
+    # one pass from the first '{' that copies the text into out while
+    #  - escaping raw control characters inside strings
+    #  - dropping trailing commas before a closing bracket
+    #  - stopping as soon as the root object closes (so trailing fences/chatter are ignored)
+    #  - recording "safe points": output positions right after a value has fully closed, together with the
+    #    brackets needed to close everything still open at that point
+    # returns (out, safe_points, complete, tail) where tail is the closed-off text to try when truncated
+    out = []
+    safe_points = []
+    stack = []  # opening brackets still open
+    expecting_key = []  # for each open container: True while an object is waiting for a key
+    closers = ""  # closing brackets for the current stack, innermost first
+
+    in_string = False
+    escape = False
+    string_is_key = False
+    in_scalar = False
+
+    for ch in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == "\\":
+                escape = True
+                out.append(ch)
+            elif ch == '"':
+                in_string = False
+                out.append(ch)
+                if not string_is_key:
+                    safe_points.append((len(out), closers))
+            elif ch < " ":
+                out.append(_STRING_ESCAPES.get(ch) or f"\\u{ord(ch):04x}")
+            else:
+                out.append(ch)
+            continue
+
+        if in_scalar and (ch in ",}]" or ch.isspace()):
+            # numbers/true/false/null only end when something else starts
+            in_scalar = False
+            safe_points.append((len(out), closers))
+
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(expecting_key) and expecting_key[-1]
+            out.append(ch)
+        elif ch in "{[":
+            stack.append(ch)
+            expecting_key.append(ch == "{")
+            closers = _CLOSERS[ch] + closers
+            out.append(ch)
+            if len(stack) == 1:
+                safe_points.append((len(out), closers))
+        elif ch in "}]":
+            if not stack:
+                break
+            while out and (out[-1].isspace() or out[-1] == ","):
+                out.pop()
+            # whatever the model wrote, close the bracket that's actually open
+            out.append(_CLOSERS[stack.pop()])
+            expecting_key.pop()
+            closers = closers[1:]
+            if not stack:
+                return out, safe_points, True, None
+            safe_points.append((len(out), closers))
+        elif ch == ":":
+            if expecting_key:
+                expecting_key[-1] = False
+            out.append(ch)
+        elif ch == ",":
+            if expecting_key and stack[-1] == "{":
+                expecting_key[-1] = True
+            out.append(ch)
+        elif ch.isspace():
+            out.append(ch)
+        else:
+            in_scalar = True
+            out.append(ch)
+
+    # ran out of text before the root object closed
+    if in_string and not string_is_key:
+        # keeping the partial string value, since its text is still useful (e.g. a cut-off explanation)
+        if escape:
+            out.pop()
+        return out, safe_points, False, "".join(out) + '"' + closers
+    if safe_points:
+        pos, safe_closers = safe_points[-1]
+        return out, safe_points, False, "".join(out[:pos]) + safe_closers
+    return out, safe_points, False, "{}"
@@ -0,0 +1,157 @@
+import json
+
+
+class JsonArrayItemStream:
+    # incremental scanner for model output shaped like {"nodes": [{...}, ...], "edges": [{...}, ...]}.
+    # feed() takes text as it streams in and returns (array_key, item) for every object that has
+    # closed inside a top-level array, so callers can act on each node/edge without waiting for the rest.
+    # anything before the first '{' (code fences, "json" tags, chatter) is skipped
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_chars = None  # characters of a top-level key while it's being read
+        self._pending_key = None  # last top-level key read, waiting for its value
+        self._array_key = None  # key of the top-level array we're currently inside
+        self._item_chars = None  # characters of the array item being captured
+
+    def feed(self, text):
+        items = []
+        for ch in text:
+            if self._in_string:
+                if self._item_chars is not None:
+                    # models often put raw newlines inside strings, which json.loads rejects
+                    self._item_chars.append("\\n" if ch == "\n" and not self._escape else ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._pending_key = "".join(self._key_chars)
+                        self._key_chars = None
+                elif self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+
+            if self._depth == 0 and ch != "{":
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._key_chars = []
+            elif ch in "{[":
+                if self._depth == 1 and ch == "[":
+                    self._array_key = self._pending_key
+                elif self._depth == 2 and ch == "{" and self._array_key is not None:
+                    self._item_chars = []
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    self._array_key = None
+
+            if self._item_chars is not None:
+                self._item_chars.append(ch)
+                if self._depth == 2:
+                    item = self._decode_item()
+                    if item is not None:
+                        items.append((self._array_key, item))
+        return items
+
+    def _decode_item(self):
+        raw = "".join(self._item_chars)
+        self._item_chars = None
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            print(f"Skipping unparseable streamed item: {e}")
+            return None
+
+
+class JsonStringFieldStream:
+    # incremental scanner that pulls the decoded text of one top-level string field
+    # (e.g. {"explanation": "..."}) out of streaming model output, a piece at a time
+
+    def __init__(self, field):
+        self.field = field
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._escape_chars = None  # pending escape sequence inside the streamed value
+        self._key_chars = None
+        self._awaiting_value = False  # saw the field's key, waiting for the opening quote
+        self._streaming = False  # inside the field's string value
+        self.finished = False
+
+    def feed(self, text):
+        out = []
+        for ch in text:
+            if self.finished:
+                break
+
+            if self._streaming:
+                if self._escape_chars is not None:
+                    self._escape_chars.append(ch)
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        out.append(decoded)
+                elif ch == "\\":
+                    self._escape_chars = [ch]
+                elif ch == '"':
+                    self._streaming = False
+                    self.finished = True
+                else:
+                    out.append(ch)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    if self._key_chars is not None:
+                        self._key_chars.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    if self._key_chars is not None:
+                        self._key_chars.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._awaiting_value = "".join(self._key_chars) == self.field
+                        self._key_chars = None
+                elif self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+
+            if self._depth == 0 and ch != "{":
+                continue
+
+            if ch == '"':
+                if self._awaiting_value and self._depth == 1:
+                    self._streaming = True
+                    self._awaiting_value = False
+                else:
+                    self._in_string = True
+                    self._key_chars = [] if self._depth == 1 else None
+            elif ch in "{[":
+                self._depth += 1
+                self._awaiting_value = False
+            elif ch in "}]":
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                self._awaiting_value = False
+        return "".join(out)
+
+    def _decode_escape(self):
+        # waits until an escape sequence is complete (\n is 2 chars, \uXXXX is 6) before decoding it
+        raw = "".join(self._escape_chars)
+        if len(raw) < 2 or (raw[1] == "u" and len(raw) < 6):
+            return None
+        self._escape_chars = None
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return raw
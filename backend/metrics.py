@@ -0,0 +1,259 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import random
+import threading
+import time
+
+# bucket bounds in seconds for in-process stages (parsing, prompt building, post-processing)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# bucket bounds in seconds for model calls and whole requests
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+# bucket bounds for prompt/completion sizes, in tokens (or characters / CHARS_PER_TOKEN when no usage is reported)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    # set from a snapshot (cache sizes, calls in flight) right before /metrics renders
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts (+inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [f'le="{bound}"'])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    # the handful of metric types /metrics needs, rendered in the prometheus text format
+    # (ref: https://prometheus.io/docs/instrumenting/exposition_formats/)
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "flex_stage_seconds", "Time spent in each in-process stage of an analysis.", ["stage"], STAGE_BUCKETS
+)
+MODEL_CALL_SECONDS = REGISTRY.histogram(
+    "flex_model_call_seconds", "Model call latency, from request to last token.", ["kind"]
+)
+MODEL_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "flex_model_first_token_seconds", "Time to the first token of streamed model calls.", ["kind"]
+)
+MODEL_QUEUE_SECONDS = REGISTRY.histogram(
+    "flex_model_queue_seconds", "Time model calls waited for a concurrency slot.", [], STAGE_BUCKETS + (5.0, 10.0)
+)
+MODEL_CALLS = REGISTRY.counter("flex_model_calls_total", "Model calls made, by outcome.", ["kind", "outcome"])
+MODEL_TOKENS = REGISTRY.counter("flex_model_tokens_total", "Tokens reported by the model's usage.", ["kind", "type"])
+PROMPT_TOKENS = REGISTRY.histogram(
+    "flex_prompt_tokens", "Prompt size per model call, in tokens as reported by usage.", ["kind"], TOKEN_BUCKETS
+)
+PROMPT_CHARS = REGISTRY.histogram(
+    "flex_prompt_chars", "Prompt size per model call in characters, measured before sending.", ["kind"],
+    tuple(bound * 4 for bound in TOKEN_BUCKETS),
+)
+JSON_PARSE_PHASES = REGISTRY.counter(
+    "flex_json_parse_total", "Model responses parsed, by the recovery phase that succeeded (none if it failed).", ["phase"]
+)
+HTTP_REQUESTS = REGISTRY.counter("flex_http_requests_total", "Requests handled, by route and status.", ["route", "status"])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "flex_http_request_seconds", "Request latency by route, until the response body was fully sent.", ["route"]
+)
+
+
+# the sampled trace of the request being handled, if any. executor threads only see it when the work was
+# submitted through submit_traced
+_current_trace = contextvars.ContextVar("flex_trace", default=None)
+
+
+class Trace:
+    # everything recorded for one sampled request; written as a single json line when the request ends
+
+    def __init__(self, route):
+        self.route = route
+        self.started_at = time.monotonic()
+        self.timestamp = time.time()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, event, **fields):
+        with self._lock:
+            self.events.append({"event": event, "at": round(time.monotonic() - self.started_at, 4), **fields})
+
+
+class TraceLog:
+    # per-request trace log for a sample_rate fraction of requests (0 disables it, 1 traces everything),
+    # written as json lines to path, or printed when no path is set
+
+    def __init__(self, sample_rate=0.0, path=None):
+        self.sample_rate = sample_rate
+        self.path = path
+        self._lock = threading.Lock()
+
+    def start(self, route):
+        # returns a token for finish(); the trace becomes current for this context only when sampled
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        trace = Trace(route)
+        return trace, _current_trace.set(trace)
+
+    def finish(self, started, status):
+        if started is None:
+            return
+        trace, token = started
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # finished from another context, e.g. after a streamed response was closed
+            pass
+        record = {
+            "route": trace.route,
+            "timestamp": trace.timestamp,
+            "status": status,
+            "seconds": round(time.monotonic() - trace.started_at, 4),
+            "events": trace.events,
+        }
+        line = json.dumps(record)
+        with self._lock:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            else:
+                print(line)
+
+
+def trace_event(event, **fields):
+    # adds to the current request's trace; a no-op for requests that weren't sampled
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(event, **fields)
+
+
+def submit_traced(executor, fn, *args):
+    # executor.submit that carries the current trace over to the worker thread
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+@contextlib.contextmanager
+def stage(name):
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started_at
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace_event("stage", stage=name, seconds=round(elapsed, 6))
+
+
+def record_model_call(kind, seconds, usage=None, first_token_seconds=None, error=None):
+    # usage is the completion's usage object (prompt_tokens, completion_tokens), when the api reported one
+    MODEL_CALL_SECONDS.observe(seconds, kind=kind)
+    MODEL_CALLS.inc(kind=kind, outcome=type(error).__name__ if error else "ok")
+    if first_token_seconds is not None:
+        MODEL_FIRST_TOKEN_SECONDS.observe(first_token_seconds, kind=kind)
+
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if isinstance(prompt_tokens, int):
+        MODEL_TOKENS.inc(prompt_tokens, kind=kind, type="prompt")
+        PROMPT_TOKENS.observe(prompt_tokens, kind=kind)
+    if isinstance(completion_tokens, int):
+        MODEL_TOKENS.inc(completion_tokens, kind=kind, type="completion")
+
+    trace_event(
+        "model_call", kind=kind, seconds=round(seconds, 4),
+        first_token_seconds=round(first_token_seconds, 4) if first_token_seconds is not None else None,
+        prompt_tokens=prompt_tokens if isinstance(prompt_tokens, int) else None,
+        completion_tokens=completion_tokens if isinstance(completion_tokens, int) else None,
+        error=str(error) if error else None,
+    )
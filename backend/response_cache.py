@@ -0,0 +1,184 @@
+import ast
+import copy
+import hashlib
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class _LocalNameNormalizer(ast.NodeTransformer):
+    # renames names bound inside each function body to positional placeholders, so two submissions that
+    # only differ in local variable naming produce the same tree.
+    # parameters keep their real names: callers can pass them by keyword, and f(a=1) only works if f's
+    # parameter is actually called a. placeholders are numbered across the whole module, so a nested
+    # function's locals can't take the same placeholder as an outer name it closes over
+
+    def __init__(self):
+        self._placeholders = itertools.count()
+
+    def visit_FunctionDef(self, node):
+        # parameters of this function and of any lambda or function nested in it are left alone, which also
+        # keeps a nested parameter from being renamed by the enclosing function's mapping
+        kept = {sub.arg for sub in ast.walk(node) if isinstance(sub, ast.arg)}
+        bound = []
+        for sub in ast.walk(node):
+            if isinstance(sub, (ast.Global, ast.Nonlocal)):
+                kept.update(sub.names)
+            elif isinstance(sub, ast.Name) and isinstance(sub.ctx, ast.Store):
+                bound.append(sub.id)
+
+        # dict.fromkeys keeps first-seen order, which keeps the placeholders deterministic
+        mapping = {
+            name: f"_v{next(self._placeholders)}"
+            for name in dict.fromkeys(n for n in bound if n not in kept)
+        }
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Name) and sub.id in mapping:
+                sub.id = mapping[sub.id]
+
+        self.generic_visit(node)
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+
+def fingerprint_code(tree):
+    # hashing a normalized dump of the ast: formatting and comments never reach the tree,
+    # line/column attributes are left out of the dump, and local names are canonicalized
+    normalized = _LocalNameNormalizer().visit(copy.deepcopy(tree))
+    dumped = ast.dump(normalized, annotate_fields=False, include_attributes=False)
+    return hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+
+
+def statement_lines(tree):
+    # [first line, last line] of every statement, in ast.walk order. this is what fingerprint_code leaves out:
+    # two trees with the same fingerprint have the same statements in the same order, only (possibly) on
+    # different lines, so responses that mention line numbers can be carried from one to the other
+    return [[stmt.lineno, stmt.end_lineno or stmt.lineno] for stmt in ast.walk(tree) if isinstance(stmt, ast.stmt)]
+
+
+def make_cache_key(kind, code_fingerprint, intent, model, prompt_version):
+    # intent whitespace is collapsed so trailing newlines or double spaces don't split the cache
+    normalized_intent = " ".join(intent.split())
+    raw = "\x1f".join([kind, code_fingerprint, normalized_intent, model, str(prompt_version)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # two-tier cache for model responses: an in-process lru (bounded by entry count, total bytes and ttl)
+    # in front of an optional sqlite file that survives restarts and is shared between worker processes
+    # (ref: https://docs.python.org/3/library/sqlite3.html)
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl_seconds=24 * 60 * 60, db_path=None,
+                 table="responses"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        # caches with different ttls can share one sqlite file, each in its own table
+        self.table = table
+
+        self._entries = OrderedDict()  # key -> (stored_at, serialized value)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        if self.db_path:
+            with self._connection() as conn:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+                # every write prunes expired rows by stored_at; without an index that's a full scan under the
+                # writer lock the worker processes share
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_stored_at ON {self.table} (stored_at)")
+
+    def _connection(self):
+        # sqlite connections can't be shared across threads, so each thread keeps its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            # wal lets several worker processes read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _is_expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, serialized = entry
+                if self._is_expired(stored_at):
+                    self._remove(key)
+                    self.stats["expired"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return json.loads(serialized)
+
+        if self.db_path:
+            try:
+                with self._connection() as conn:
+                    row = conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Response cache read error: {e}")
+                row = None
+            if row is not None and not self._is_expired(row[1]):
+                serialized, stored_at = row
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                    self._store(key, serialized, stored_at)
+                return json.loads(serialized)
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        # values are stored serialized so callers always get a fresh copy they're free to mutate
+        serialized = json.dumps(value)
+        stored_at = time.time()
+        with self._lock:
+            self._store(key, serialized, stored_at)
+
+        if self.db_path:
+            try:
+                with self._connection() as conn:
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                        (key, serialized, stored_at),
+                    )
+                    if self.ttl_seconds is not None:
+                        conn.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (stored_at - self.ttl_seconds,))
+            except sqlite3.Error as e:
+                print(f"Response cache write error: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._total_bytes)
+
+    def _store(self, key, serialized, stored_at):
+        # caller holds the lock
+        if key in self._entries:
+            self._remove(key)
+        size = len(serialized)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (stored_at, serialized)
+        self._total_bytes += size
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        # caller holds the lock
+        _, serialized = self._entries.pop(key)
+        self._total_bytes -= len(serialized)
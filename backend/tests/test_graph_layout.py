@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_layout import NODE_GAP, NODE_WIDTH, layout_shape  # noqa: E402
+
+
+def assert_spaced(positions):
+    by_row = {}
+    for x, y in positions:
+        by_row.setdefault(y, []).append(x)
+    for xs in by_row.values():
+        xs.sort()
+        assert all(right - left >= NODE_WIDTH + NODE_GAP - 0.1 for left, right in zip(xs, xs[1:])), xs
+
+
+def test_seeded_nodes_without_edges_dont_overlap():
+    positions = layout_shape(3, [], [(0, 0), None, (10, 0)])
+    assert_spaced(positions)
+    # seeded nodes keep their left-to-right order
+    assert positions[0][0] < positions[2][0]
+
+
+def test_layered_graph_is_spaced():
+    assert_spaced(layout_shape(5, [(0, 1), (0, 2), (0, 3), (3, 4)], [(0, 0), None, (5, 0), None, None]))
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from incremental import namespace_unit_graph  # noqa: E402
+
+
+def edge_pairs(subgraph):
+    return [(edge["source"], edge["target"]) for edge in subgraph["edges"]]
+
+
+def test_units_reusing_a_local_id_keep_their_own_edges():
+    nodes = [
+        {"id": "entry", "unit": "__module__", "label": "Start"},
+        {"id": "loop", "unit": "__module__", "label": "Loop over the scores"},
+        {"id": "entry", "unit": "push", "label": "Enter push"},
+        {"id": "body", "unit": "push", "label": "Sift the value up"},
+    ]
+    edges = [{"source": "entry", "target": "loop"}, {"source": "entry", "target": "body"}]
+    subgraphs = namespace_unit_graph(nodes, edges, ["__module__", "push"], set())
+    assert edge_pairs(subgraphs["__module__"]) == [("__module__::entry", "__module__::loop")]
+    assert edge_pairs(subgraphs["push"]) == [("push::entry", "push::body")]
+
+
+def test_edges_to_reused_units_and_ambiguous_ids():
+    nodes = [
+        {"id": "entry", "unit": "push", "label": "Enter push"},
+        {"id": "swap", "unit": "push", "label": "Swap with the parent"},
+        {"id": "entry", "unit": "pop", "label": "Enter pop"},
+    ]
+    edges = [
+        {"source": "swap", "target": "heap::compare"},
+        # both changed units have an "entry", so this can't be placed without a unit tag
+        {"source": "entry", "target": "heap::compare"},
+        {"source": "entry", "target": "heap::compare", "unit": "pop"},
+    ]
+    subgraphs = namespace_unit_graph(nodes, edges, ["push", "pop"], {"heap::compare"})
+    assert edge_pairs(subgraphs["push"]) == [("push::swap", "heap::compare")]
+    assert edge_pairs(subgraphs["pop"]) == [("pop::entry", "heap::compare")]
@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_recovery import recover_json  # noqa: E402
+from json_stream import JsonArrayItemStream, JsonStringFieldStream  # noqa: E402
+
+GRAPH = {
+    "nodes": [
+        {"id": "push", "label": "Append the value to the heap", "lines": "1-2"},
+        {
+            "id": "compare",
+            "label": "Compare heap[index] with its parent",
+            "lines": "4-6",
+            "error": {"line": "if heap[index] > heap[parent]:", "message": "A smaller value never moves up."},
+        },
+        {"id": "swap", "label": "Swap with the parent", "lines": "7"},
+    ],
+    "edges": [
+        {"id": "e1", "source": "push", "target": "compare"},
+        {"id": "e2", "source": "compare", "target": "swap"},
+    ],
+}
+
+
+def is_prefix(recovered, original):
+    # what a cut-off response can still hold: everything before the cut intact, and the last value open
+    # at the cut (a string, list or object) holding the beginning of the original one
+    if isinstance(original, dict):
+        return isinstance(recovered, dict) and all(
+            key in original and is_prefix(value, original[key]) for key, value in recovered.items()
+        )
+    if isinstance(original, list):
+        return (
+            isinstance(recovered, list)
+            and len(recovered) <= len(original)
+            and recovered[:-1] == original[: len(recovered) - 1]
+            and (not recovered or is_prefix(recovered[-1], original[len(recovered) - 1]))
+        )
+    if isinstance(original, str):
+        return isinstance(recovered, str) and original.startswith(recovered)
+    return recovered == original
+
+
+def test_valid_json_is_parsed_directly():
+    assert recover_json(json.dumps(GRAPH)) == (GRAPH, "direct")
+
+
+def test_fenced_json():
+    assert recover_json(f"```json\n{json.dumps(GRAPH, indent=2)}\n```") == (GRAPH, "trimmed")
+
+
+def test_chatter_around_json():
+    text = f"Here is the conceptual graph:\n{json.dumps(GRAPH, indent=2)}\nLet me know if you need more."
+    assert recover_json(text) == (GRAPH, "trimmed")
+
+
+def test_trailing_commas():
+    text = json.dumps(GRAPH, indent=2).replace("}\n  ]", "},\n  ]").replace('"7"\n', '"7",\n')
+    assert recover_json(text) == (GRAPH, "repaired")
+
+
+def test_raw_newlines_inside_strings():
+    explanation = {"explanation": "- `line 4`: the comparison is reversed,\n  so smaller values stay put."}
+    text = json.dumps(explanation, indent=2).replace("\\n", "\n")
+    assert recover_json(text)[0] == explanation
+    assert recover_json(f"```json\n{text}\n```")[0] == explanation
+
+
+def test_no_json():
+    assert recover_json("I could not produce a graph for this code.") == (None, None)
+
+
+def test_truncated_graph_keeps_a_prefix_of_the_nodes_at_any_offset():
+    for text in (json.dumps(GRAPH), json.dumps(GRAPH, indent=2)):
+        for end in range(1, len(text)):
+            value, phase = recover_json(text[:end])
+            assert isinstance(value, dict), (end, text[:end])
+            assert phase == "truncated", (end, phase)
+            assert is_prefix(value, GRAPH), (end, value)
+
+
+def test_truncated_graph_inside_a_fence():
+    text = json.dumps(GRAPH, indent=2)
+    value, _ = recover_json(f"```json\n{text[: text.index('swap')]}")
+    assert value["nodes"][:2] == GRAPH["nodes"][:2]
+
+
+def test_array_item_stream_yields_each_item_once_it_closes():
+    text = f"```json\n{json.dumps(GRAPH, indent=2)}\n```"
+    stream = JsonArrayItemStream()
+    items = []
+    for ch in text:
+        items.extend(stream.feed(ch))
+    assert items == [("nodes", node) for node in GRAPH["nodes"]] + [("edges", edge) for edge in GRAPH["edges"]]
+
+
+def test_array_item_stream_accepts_raw_newlines_and_skips_the_unfinished_item():
+    text = '{"nodes": [{"id": "a", "label": "two\nlines"}, {"id": "b", "lab'
+    assert JsonArrayItemStream().feed(text) == [("nodes", {"id": "a", "label": "two\nlines"})]
+
+
+def test_string_field_stream_decodes_escapes_split_across_chunks():
+    value = "café \"heap\"\n\tdone"
+    text = json.dumps({"other": "x", "explanation": value, "after": "y"}, ensure_ascii=True)
+    stream = JsonStringFieldStream("explanation")
+    pieces = [stream.feed(text[i:i + 3]) for i in range(0, len(text), 3)]
+    assert "".join(pieces) == value
+    assert stream.finished
+
+
+def test_string_field_stream_ignores_nested_fields_with_the_same_name():
+    stream = JsonStringFieldStream("explanation")
+    assert stream.feed('{"node": {"explanation": "inner"}, "explanation": "outer"}') == "outer"
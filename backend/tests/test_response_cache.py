@@ -0,0 +1,28 @@
+import ast
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import fingerprint_code  # noqa: E402
+
+
+def fingerprint(code):
+    return fingerprint_code(ast.parse(code))
+
+
+def test_renamed_locals_share_a_fingerprint():
+    assert fingerprint("def f(a):\n    b = a + 1\n    return b\n") == fingerprint("def f(a):\n    y = a + 1\n    return y\n")
+
+
+def test_parameter_names_are_kept_for_keyword_calls():
+    # f(a=1) raises TypeError once the parameter is renamed, so the two can't share a cached response
+    working = "def f(a):\n    return a\n\nf(a=1)\n"
+    broken = "def f(b):\n    return b\n\nf(a=1)\n"
+    assert fingerprint(working) != fingerprint(broken)
+
+
+def test_nested_function_locals_dont_collide_with_closed_over_names():
+    closes_over = "def outer(a):\n    def inner(b):\n        return a + b\n    return inner\n"
+    own_local = "def outer(a):\n    def inner(b):\n        return b + b\n    return inner\n"
+    assert fingerprint(closes_over) != fingerprint(own_local)
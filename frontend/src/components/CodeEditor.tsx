@@ -1,6 +1,6 @@
 import React, { useState } from "react";
 import MonacoEditor from "@monaco-editor/react"; // referencing monaco editor docs: https://github.com/suren-atoyan/monaco-react
-import { analyzeCode } from "../services/api";
+import { analyzeCode, getExplanation } from "../services/api";
 import FlowNodeComponent from "./FlowNodeComponent";
 import { Tabs, Tab, Spinner } from 'react-bootstrap';
 import { Node, Edge } from 'reactflow';
@@ -22,13 +22,39 @@ const CodeEditor: React.FC = () => {
   const [edges, setEdges] = useState<Edge[]>([]);
   const [highLevelFeedback, setHighLevelFeedback] = useState<HighLevelFeedback | null>(null);
   const [loading, setLoading] = useState(false);
+  // code and intent as of the last analysis, so node explanations match the graph even after further edits
+  const [analyzed, setAnalyzed] = useState<{ code: string; intent: string } | null>(null);
+
+  // with lazy explanations the summary isn't part of the analysis response, so it's loaded separately
+  const loadSummary = async (submittedCode: string, submittedIntent: string) => {
+    try {
+      const data = await getExplanation(submittedCode, submittedIntent);
+      setHighLevelFeedback({
+        summary: data.explanation.description,
+        strengths: [],
+        weaknesses: [],
+        recommendations: [],
+      });
+    } catch (error) {
+      console.error("Error loading summary:", error);
+    }
+  };
 
   // this function calls analyzeCode (like a user hitting 'submit')
   const handleSubmit = async () => {
     setLoading(true);
+    setHighLevelFeedback(null);
     try {
       const data = await analyzeCode(code, intent);
-  
+      setNodes(data.nodes);
+      setEdges(data.edges);
+      setAnalyzed({ code, intent });
+
+      if (!data.high_level_feedback) {
+        loadSummary(code, intent);
+        return;
+      }
+
       let feedback: HighLevelFeedback;
   
       if ("explanation" in data.high_level_feedback) {
@@ -49,8 +75,6 @@ const CodeEditor: React.FC = () => {
         };
       }
   
-      setNodes(data.nodes);
-      setEdges(data.edges);
       setHighLevelFeedback(feedback);
     } catch (error) {
       console.error("Error analyzing code:", error);
@@ -89,9 +113,14 @@ const CodeEditor: React.FC = () => {
         </div>
         <div className="col-md-6">
           {loading && <Spinner animation="border" />}
-          {!loading && highLevelFeedback && (
+          {!loading && analyzed && (
             <Tabs defaultActiveKey="feedback" className="mt-4">
               <Tab eventKey="feedback" title="High-Level Feedback">
+                {!highLevelFeedback ? (
+                  <div className="mt-3">
+                    <Spinner animation="border" size="sm" /> Loading feedback...
+                  </div>
+                ) : (
                 <div className="mt-3">
                   <h5>Summary</h5>
                   {/* parse summary as markdown */}
@@ -131,10 +160,11 @@ const CodeEditor: React.FC = () => {
                     </>
                   )}
                 </div>
+                )}
               </Tab>
               <Tab eventKey="visualization" title="Visualization">
                 <div className="mt-3" style={{ height: '500px' }}>
-                  <FlowNodeComponent nodes={nodes} edges={edges} />
+                  <FlowNodeComponent nodes={nodes} edges={edges} code={analyzed.code} intent={analyzed.intent} />
                 </div>
               </Tab>
             </Tabs>
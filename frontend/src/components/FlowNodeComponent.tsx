@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import ReactFlow, {
   MiniMap,
   Controls,
@@ -25,6 +25,9 @@ interface Explanation {
 interface FlowNodeProps {
   nodes: Node[];
   edges: Edge[];
+  // the submission the graph was built from, needed to fetch node explanations on demand
+  code: string;
+  intent: string;
 }
 
 // constructing a dagre graph for auto-layout
@@ -45,17 +48,24 @@ const getLayoutedElements = (nodes: Node[], edges: Edge[]) => {
     dagreGraph.setEdge(edge.source, edge.target);
   });
 
-  dagre.layout(dagreGraph);
+  // the backend lays graphs out itself (backend/graph_layout.py); dagre is only the fallback for graphs
+  // that arrive with every node still at the origin
+  const needsLayout = nodes.every((node) => !node.position || (node.position.x === 0 && node.position.y === 0));
+  if (needsLayout) {
+    dagre.layout(dagreGraph);
+  }
 
   nodes.forEach((node) => {
-    const nodeWithPosition = dagreGraph.node(node.id);
     node.targetPosition = isHorizontal ? Position.Left : Position.Top;
     node.sourcePosition = isHorizontal ? Position.Right : Position.Bottom;
 
-    node.position = {
-      x: nodeWithPosition.x - nodeWidth / 2,
-      y: nodeWithPosition.y - nodeHeight / 2,
-    };
+    if (needsLayout) {
+      const nodeWithPosition = dagreGraph.node(node.id);
+      node.position = {
+        x: nodeWithPosition.x - nodeWidth / 2,
+        y: nodeWithPosition.y - nodeHeight / 2,
+      };
+    }
 
     node.style = {
       ...node.style,
@@ -67,12 +77,14 @@ const getLayoutedElements = (nodes: Node[], edges: Edge[]) => {
   return { nodes, edges };
 };
 
-const FlowNodeComponent: React.FC<FlowNodeProps> = ({ nodes, edges }) => {
+const FlowNodeComponent: React.FC<FlowNodeProps> = ({ nodes, edges, code, intent }) => {
   const [selectedNode, setSelectedNode] = useState<Node | null>(null);
   const [explanation, setExplanation] = useState<Explanation | null>(null);
   const [showModal, setShowModal] = useState(false);
   const [layoutedNodes, setLayoutedNodes] = useState<Node[]>([]);
   const [layoutedEdges, setLayoutedEdges] = useState<Edge[]>([]);
+  // id of the most recently clicked node, so a slow explanation can't replace a newer one
+  const lastClickedId = useRef<string | null>(null);
 
   // recalculate layout whenever nodes or edges change
   useEffect(() => {
@@ -84,19 +96,30 @@ const FlowNodeComponent: React.FC<FlowNodeProps> = ({ nodes, edges }) => {
   const onNodeClick = async (_event: React.MouseEvent, node: Node) => {
     setSelectedNode(node);
     setShowModal(true);
+    lastClickedId.current = node.id;
 
+    // eagerly analyzed graphs already carry their error text
     if (node.data.error) {
       setExplanation({ description: node.data.error });
-    } else {
-      setExplanation({ description: "No errors in this node." });
+      return;
+    }
+
+    setExplanation(null);
+    try {
+      const data = await getExplanation(code, intent, node.data);
+      if (lastClickedId.current === node.id) setExplanation(data.explanation);
+    } catch (error) {
+      if (lastClickedId.current === node.id) {
+        setExplanation({ description: "Could not load an explanation for this node." });
+      }
     }
   };
 
   const nodeTypes = {
     customNode: (props: NodeProps) => {
       const { data } = props;
-      // highlight node red if data.error exists
-      const hasError = !!data.error;
+      // highlight node red if data.error exists (or has_error, when the explanation is loaded on click)
+      const hasError = !!data.error || !!data.has_error;
 
       return (
         <div
@@ -5,7 +5,8 @@ const API_BASE_URL = 'http://localhost:5000'; // Ensure this matches your backen
 interface AnalyzeCodeResponse {
   nodes: any[];
   edges: any[];
-  high_level_feedback: {
+  // left out when the backend runs with lazy explanations; fetch it with getExplanation(code, intent)
+  high_level_feedback?: {
     summary: string;
     strengths?: string[];
     weaknesses?: string[];
@@ -32,12 +33,68 @@ interface GetExplanationResponse {
   };
 }
 
-export const getExplanation = async (nodeInfo: string): Promise<GetExplanationResponse> => {
+// explains one graph node (pass its data: label, lines, has_error), or the whole program when node is omitted
+export const getExplanation = async (code: string, intent: string, node?: any): Promise<GetExplanationResponse> => {
   try {
-    const response = await axios.post(`${API_BASE_URL}/api/get_explanation`, { nodeInfo });
+    const response = await axios.post(`${API_BASE_URL}/api/get_explanation`, { code, intent, node });
     return response.data;
   } catch (error) {
     console.error('Error in getExplanation:', error);
     throw error;
   }
 };
+
+
+// event names sent by /api/analyze_code/stream
+export type AnalyzeStreamEvent =
+  | 'node'
+  | 'edge'
+  | 'node_error'
+  | 'layout'
+  | 'graph_error'
+  | 'explanation_delta'
+  | 'explanation'
+  | 'done';
+
+// streaming variant of analyzeCode: calls onEvent for every server-sent event as it arrives
+// (uses fetch instead of axios/EventSource since we need to POST and read the body incrementally)
+export const analyzeCodeStream = async (
+  code: string,
+  intent: string,
+  onEvent: (event: AnalyzeStreamEvent, payload: any) => void
+): Promise<void> => {
+  const response = await fetch(`${API_BASE_URL}/api/analyze_code/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ code, intent }),
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`analyzeCodeStream failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // events are separated by a blank line
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+
+      let eventName = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach((line) => {
+        if (line.startsWith('event: ')) eventName = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+      onEvent(eventName as AnalyzeStreamEvent, data ? JSON.parse(data) : null);
+    }
+  }
+};